@@ -0,0 +1,98 @@
+"""Benchmark consumer reads of chunk files written with each HDF5 layout.
+
+Usage:
+    python src/benchmark_layout.py [--dir DIR] [--channels N] [--samples N] [--files N]
+
+Use `--dir` on the NAS to include network latency, local runs are served mostly
+from the page cache and understate the differences.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from concat.layout import chunk_shape
+
+PRESETS = ["contiguous", "time"]
+CACHE_BYTES = 16 * 1024**2
+
+
+def write_files(path: str, layout: str, data: np.ndarray, num_files: int) -> list:
+    files = []
+    for i in range(num_files):
+        file_path = os.path.join(path, f"{layout}_{i}.h5")
+        with h5py.File(file_path, "w") as file:
+            file.create_dataset(
+                "data_down", data=data, chunks=chunk_shape(layout, data.shape)
+            )
+        files.append(file_path)
+    return files
+
+
+def read_channels(files: list, first: int, count: int) -> None:
+    """Few channels over the whole span of all files."""
+    for file_path in files:
+        with h5py.File(file_path, "r", rdcc_nbytes=CACHE_BYTES) as file:
+            file["data_down"][first : first + count, :]
+
+
+def read_window(files: list, start: int, length: int) -> None:
+    """All channels over a short window of a single file."""
+    with h5py.File(files[len(files) // 2], "r", rdcc_nbytes=CACHE_BYTES) as file:
+        file["data_down"][:, start : start + length]
+
+
+def measure(func, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", help="Directory for test files (default: temp)")
+    parser.add_argument("--channels", type=int, default=2500)
+    parser.add_argument("--samples", type=int, default=30000, help="CHUNK_SIZE * SPS")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--sps", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    data = np.random.default_rng().standard_normal(
+        (args.channels, args.samples), dtype=np.float32
+    )
+    queries = {
+        "4 channels, all files": lambda files: read_channels(
+            files, args.channels // 2, 4
+        ),
+        "all channels, 10 s": lambda files: read_window(
+            files, args.samples // 2, 10 * args.sps
+        ),
+    }
+    with tempfile.TemporaryDirectory(dir=args.dir) as path:
+        results = {}
+        for layout in PRESETS:
+            files = write_files(path, layout, data, args.files)
+            results[layout] = {
+                name: measure(lambda: query(files), args.repeats)
+                for name, query in queries.items()
+            }
+
+    print(f"{'query':<24}" + "".join(f"{layout:>20}" for layout in PRESETS))
+    for name in queries:
+        row = f"{name:<24}"
+        for layout in PRESETS:
+            timing = results[layout][name]
+            speedup = results["contiguous"][name] / timing
+            row += f"{timing * 1000:>10.2f} ms {speedup:>5.1f}x"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
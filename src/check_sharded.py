@@ -0,0 +1,186 @@
+"""Check that sharded workers produce the chunks of a single-process run.
+
+Usage:
+    python src/check_sharded.py [--dir DIR] [--workers N] [--days N] [--channels N]
+
+A packet tree with a ramp signal crossing several UTC midnights is written to
+a temporary LOCAL_PATH and concatenated twice with `src/concat.py`: once by a
+single process and once by N `--sharded` workers started together, one day
+holding a stale lease (heartbeat older than LEASE_TTL) left by a dead worker.
+Chunk files of both runs must be identical, no run may log an error and the
+stale lease must be taken over.
+"""
+import argparse
+import configparser
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import h5py
+import numpy as np
+import pytz
+
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+# Packets of 2 s at 1000 Hz, concatenated at 100 Hz into 60 s chunks
+PACKET_SECONDS = 2
+PACKET_SAMPLES = 200
+CHUNK_SIZE = 60
+LEASE_TTL = 600
+
+
+def write_tree(local_path: str, days: int, channels: int) -> list:
+    """Write Mekorot packets from 23:50 to 00:10 around each midnight.
+
+    Returns:
+        list: UTC days holding packets.
+    """
+    first_day = datetime(2024, 1, 1, tzinfo=pytz.UTC)
+    packet = 0
+    for day in range(days):
+        start = first_day + timedelta(days=day, hours=23, minutes=50, seconds=1)
+        for i in range(20 * 60 // PACKET_SECONDS):
+            timestamp = int(start.timestamp()) + PACKET_SECONDS * i
+            packet_dir = os.path.join(
+                local_path,
+                datetime.fromtimestamp(timestamp, tz=pytz.UTC).strftime("%Y%m%d"),
+            )
+            os.makedirs(packet_dir, exist_ok=True)
+            # Each sample holds its index, misplaced samples are easy to spot
+            data = np.arange(
+                packet * PACKET_SAMPLES, (packet + 1) * PACKET_SAMPLES, dtype=np.float32
+            )[:, None] * np.ones((1, channels), dtype=np.float32)
+            with h5py.File(
+                os.path.join(packet_dir, f"das_SR_{timestamp}.h5"), "w"
+            ) as f:
+                f["data_down"] = data
+            with open(
+                os.path.join(packet_dir, f"{timestamp}.json"), "w", encoding="utf-8"
+            ) as f:
+                json.dump(
+                    {
+                        "index": [0, channels - 1, 0, PACKET_SAMPLES * 10 - 1],
+                        "down_factor_space": 1,
+                        "down_factor_time": 10,
+                        "spacing": [9.6, 1.0],
+                    },
+                    f,
+                )
+            packet += 1
+    return [first_day + timedelta(days=day) for day in range(days + 1)]
+
+
+def write_config(path: str, local_path: str, save_path: str) -> None:
+    """Write config.ini of a run, other settings are taken from the repository."""
+    config_dict = configparser.ConfigParser()
+    config_dict.read(os.path.join(SRC_PATH, "..", "config.ini"), encoding="UTF-8")
+    config_dict["PATH"]["LOCALPATH"] = local_path
+    config_dict["PATH"]["NASPATH_final"] = save_path
+    config_dict["SYSTEM"]["NAME"] = "Mekorot"
+    config_dict["CONSTANTS"]["CONCAT_TIME"] = str(CHUNK_SIZE)
+    config_dict["LOG"]["LOG_LEVEL"] = "WARNING"
+    config_dict["LOG"]["CONSOLE_LOG"] = "False"
+    config_dict["SHARDING"]["LEASE_TTL"] = str(LEASE_TTL)
+    config_dict["SHARDING"]["HEARTBEAT_INTERVAL"] = "1"
+    os.makedirs(path, exist_ok=True)
+    os.makedirs(save_path, exist_ok=True)
+    with open(os.path.join(path, "config.ini"), "w", encoding="utf-8") as f:
+        config_dict.write(f)
+
+
+def start_concat(path: str, *args: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, os.path.join(SRC_PATH, "concat.py"), *args], cwd=path
+    )
+
+
+def write_stale_lease(save_path: str, day: datetime) -> str:
+    """Leave the lease of a worker which died an hour ago."""
+    lease_path = os.path.join(save_path, "shards", day.strftime("%Y%m%d"), "lease")
+    os.makedirs(os.path.dirname(lease_path))
+    with open(lease_path, "w", encoding="utf-8") as f:
+        json.dump({"owner": "dead-worker", "host": "", "pid": 0, "acquired": 0}, f)
+    mtime = time.time() - 3600
+    os.utime(lease_path, (mtime, mtime))
+    return lease_path
+
+
+def read_chunks(save_path: str) -> dict:
+    chunks = {}
+    for file_path in glob.glob(os.path.join(save_path, "*", "*", "*.h5")):
+        with h5py.File(file_path, "r") as file:
+            chunks[os.path.relpath(file_path, save_path)] = file["data_down"][()]
+    return chunks
+
+
+def read_log_errors(save_path: str) -> list:
+    """Get errors logged by a run, src/concat.py exits with 0 even if it failed."""
+    errors = []
+    for log_path in glob.glob(os.path.join(save_path, "log*")):
+        with open(log_path, "r", encoding="utf-8") as f:
+            errors += [
+                f"{os.path.basename(os.path.dirname(save_path))} run: {line.strip()}"
+                for line in f
+                if "| ERROR |" in line or line.startswith("Traceback")
+            ]
+    return errors
+
+
+def compare(expected: dict, actual: dict) -> list:
+    errors = [f"missing {name}" for name in sorted(set(expected) - set(actual))]
+    errors += [f"unexpected {name}" for name in sorted(set(actual) - set(expected))]
+    for name in sorted(set(expected) & set(actual)):
+        if not np.array_equal(expected[name], actual[name], equal_nan=True):
+            errors.append(f"different data in {name}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", help="Directory for test files (default: temp)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--days", type=int, default=3, help="Midnights crossed")
+    parser.add_argument("--channels", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as path:
+        local_path = os.path.join(path, "local")
+        days = write_tree(local_path, args.days, args.channels)
+        single_path = os.path.join(path, "single")
+        sharded_path = os.path.join(path, "sharded")
+        write_config(single_path, local_path, os.path.join(single_path, "save"))
+        write_config(sharded_path, local_path, os.path.join(sharded_path, "save"))
+        lease_path = write_stale_lease(os.path.join(sharded_path, "save"), days[0])
+
+        start_time = time.perf_counter()
+        start_concat(single_path).wait()
+        print(f"Single process: {time.perf_counter() - start_time:.2f} s")
+
+        start_time = time.perf_counter()
+        workers = [start_concat(sharded_path, "--sharded") for _ in range(args.workers)]
+        for worker in workers:
+            worker.wait()
+        print(
+            f"{args.workers} sharded workers: {time.perf_counter() - start_time:.2f} s"
+        )
+
+        errors = read_log_errors(os.path.join(single_path, "save"))
+        errors += read_log_errors(os.path.join(sharded_path, "save"))
+        expected = read_chunks(os.path.join(single_path, "save"))
+        if not expected:
+            errors.append("single-process run wrote no chunks")
+        errors += compare(expected, read_chunks(os.path.join(sharded_path, "save")))
+        if os.path.exists(lease_path):
+            errors.append(f"stale lease {lease_path} was not taken over")
+        for error in errors:
+            print(error)
+        print(f"{len(expected)} chunks compared, {len(errors)} errors")
+        sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
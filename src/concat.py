@@ -1,18 +1,81 @@
 from concat.main import Concatenator
-from log.main_logger import logger as log
-import sys
+from concat.shard import ShardedConcatenator
+from concat.service import ConcatService
+from concat.trace import TracingConcatenator
+from concat.tuning import autotune, save_tuning
+from config import config_dict, load_config, load_sources
+from log.main_logger import logger as log, setup_logger
+import argparse
 
 
+parser = argparse.ArgumentParser(description="Concatenate DAS packets into chunks.")
+parser.add_argument(
+    "--num_threads",
+    type=int,
+    help="Number of threads for resampling (overrides tuning and config.ini)",
+)
+parser.add_argument(
+    "--sharded",
+    action="store_true",
+    help="Claim days through lease files to run several workers (see concat/shard.py)",
+)
+parser.add_argument(
+    "--autotune",
+    action="store_true",
+    help="Measure optimal thread counts on this host, save them and exit",
+)
+parser.add_argument(
+    "--service",
+    action="store_true",
+    help="Concatenate all [SOURCE <name>] sections of config.ini in one process",
+)
+parser.add_argument(
+    "--trace",
+    help="Record packets and stage timings of the run into a trace file "
+    "(see src/replay_trace.py)",
+)
+args = parser.parse_args()
+
+if args.service:
+    sources = load_sources(config_dict)
+    if not sources:
+        raise Exception("No [SOURCE <name>] sections in config.ini")
+    setup_logger(
+        config_dict,
+        config_dict.get(
+            "SERVICE", "LOG_PATH", fallback=next(iter(sources.values())).save_path
+        ),
+    )
+else:
+    config = load_config(config_dict)
+    setup_logger(config_dict, config.save_path)
+
 try:
-    log.info("Scheduled concatenation started.")
-    if len(sys.argv) > 1:
-        if "--num_threads" in sys.argv:
-            num_threads = int(sys.argv[sys.argv.index("--num_threads") + 1])
-            Concatenator(num_threads=num_threads)
+    if args.service:
+        log.info("Scheduled concatenation service started.")
+        ConcatService(
+            sources,
+            io_threads=config_dict.getint("SERVICE", "IO_THREADS", fallback=4),
+            cpu_threads=config_dict.getint("SERVICE", "CPU_THREADS", fallback=4),
+            memory_budget_bytes=int(
+                config_dict.getfloat("SERVICE", "MEMORY_BUDGET_MB", fallback=0)
+                * 1024**2
+            ),
+            num_threads=args.num_threads,
+        ).run()
+    elif args.autotune:
+        log.info("Autotune started.")
+        log.info("Tuning saved to %s", save_tuning(config, autotune(config)))
+    elif args.sharded:
+        log.info("Scheduled sharded concatenation started.")
+        ShardedConcatenator(config, num_threads=args.num_threads).run()
+    elif args.trace:
+        log.info("Scheduled concatenation started, recording trace.")
+        TracingConcatenator(config, args.trace, num_threads=args.num_threads).run()
     else:
-        # Use default number of threads (4).
-        # Calculated to be optimal for the current system (see test/test_num_of_threads.py)
-        Concatenator()
+        log.info("Scheduled concatenation started.")
+        # Thread counts are loaded from the tuning of this host (see concat/tuning.py)
+        Concatenator(config, num_threads=args.num_threads).run()
 except Exception as err:
     msg = (
         "Unexpected error occurred during scheduled concatenation. Details:\n\n"
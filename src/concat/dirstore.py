@@ -0,0 +1,334 @@
+"""Zarr (v2) compatible directory store of chunks, one store per UTC day.
+
+Written without zarr: arrays are zlib-compressed C-order tiles with JSON
+metadata, so a day can be opened by zarr (`zarr.open_group(path, "r")`) as well
+as read with `DayStore.read`.
+
+Layout of SAVE_PATH/YYYY/YYYYMMDD.zarr:
+    .zgroup, .zattrs           group metadata (day start, SPS)
+    data_down/.zarray          array (channels, 86400 * SPS), float32, NaN fill
+    data_down/<i>.<j>          tile i along channels, j along time
+    data_down_<channels>/      array of chunks with another channel count than
+                               the first chunk of the day
+    regions/<timestamp>.json   attrs of the chunk starting at timestamp and its
+                               array, written after its tiles, so listed
+                               regions are complete
+"""
+from typing import Iterator, Tuple, Union
+from datetime import datetime
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+import pytz
+
+from log.main_logger import logger as log
+from concat.utils import thread_map
+
+ZARR_FORMAT = 2
+DTYPE = np.dtype("<f4")
+ARRAY_NAME = "data_down"
+
+
+def _json_default(value):
+    # numpy scalars and arrays in attrs
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write through a temporary file, readers never see partial files."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def valid_runs(valid: np.ndarray) -> list:
+    """Get [start, end) ranges of True samples of a mask."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], valid.view(np.int8), [0]))))
+    return edges.reshape(-1, 2).tolist()
+
+
+class DayStore:
+    """Directory store holding `data_down` of one UTC day.
+
+    A chunk is written as the region of `data_down` at its offset from midnight.
+    Tiles of a region are compressed and written in parallel; tiles shared with
+    the previous region are read, updated and replaced atomically.
+
+    An array has a fixed number of channels. `data_down` gets the channel count
+    of the first chunk of the day, chunks with another count are written to
+    `data_down_<channels>`, so a geometry change within a day loses no data.
+
+    Attributes:
+        path (str): Directory of the store.
+        day_start (float): UTC midnight of the day (timestamp).
+        sps (int): Time frequency (in Hz).
+        channels (int): Number of channels.
+        tile_shape (tuple): Tile shape (channels, samples).
+        compression_level (int): zlib compression level.
+        array (str): Name of the array holding chunks with `channels` channels.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        day_start: float,
+        sps: int,
+        channels: int,
+        tile_shape: Tuple[int, int],
+        compression_level: int = 1,
+        array: str = ARRAY_NAME,
+    ):
+        self.path = path
+        self.day_start = day_start
+        self.sps = sps
+        self.channels = channels
+        self.tile_shape = tile_shape
+        self.compression_level = compression_level
+        self.array = array
+        self.shape = (channels, int(np.round(86400 * sps)))
+
+    @staticmethod
+    def day_path(save_path: str, timestamp: float) -> Tuple[str, float]:
+        """Get path and day start of the store holding the timestamp."""
+        day = datetime.fromtimestamp(timestamp, tz=pytz.UTC).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        path = os.path.join(
+            save_path, day.strftime("%Y"), day.strftime("%Y%m%d") + ".zarr"
+        )
+        return path, day.timestamp()
+
+    @classmethod
+    def for_timestamp(
+        cls,
+        save_path: str,
+        timestamp: float,
+        sps: int,
+        channels: int,
+        tile_shape: Tuple[int, int],
+        compression_level: int = 1,
+    ) -> "DayStore":
+        path, day_start = cls.day_path(save_path, timestamp)
+        return cls(path, day_start, sps, channels, tile_shape, compression_level)
+
+    def _array_path(self) -> str:
+        return os.path.join(self.path, self.array)
+
+    def _read_array_meta(self) -> Union[None, dict]:
+        try:
+            with open(
+                os.path.join(self._array_path(), ".zarray"), "r", encoding="utf-8"
+            ) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def open(self) -> "DayStore":
+        """Create the store and the array for `channels` if they do not exist.
+
+        Raises:
+            ValueError: If the existing array has different SPS.
+        """
+        self.array = ARRAY_NAME
+        meta = self._read_array_meta()
+        if meta is not None and meta["shape"][0] != self.channels:
+            # Channel count changed during the day
+            self.array = f"{ARRAY_NAME}_{self.channels}"
+            meta = self._read_array_meta()
+        if meta is not None:
+            if tuple(meta["shape"]) != self.shape:
+                raise ValueError(
+                    f"Array {self._array_path()} has shape {tuple(meta['shape'])}, "
+                    f"chunk needs {self.shape}"
+                )
+            # Tiles of an existing array are kept
+            self.tile_shape = tuple(meta["chunks"])
+            return self
+
+        if self.array != ARRAY_NAME:
+            log.warning(
+                "Channel count of %s changed to %s, creating array %s",
+                self.path,
+                self.channels,
+                self.array,
+            )
+        log.debug("Creating array %s", self._array_path())
+        os.makedirs(self._array_path(), exist_ok=True)
+        os.makedirs(os.path.join(self.path, "regions"), exist_ok=True)
+        if not os.path.exists(os.path.join(self.path, ".zgroup")):
+            _write_atomic(
+                os.path.join(self.path, ".zgroup"),
+                json.dumps({"zarr_format": ZARR_FORMAT}).encode(),
+            )
+            _write_atomic(
+                os.path.join(self.path, ".zattrs"),
+                json.dumps({"day_start": self.day_start, "sps": self.sps}).encode(),
+            )
+        _write_atomic(
+            os.path.join(self._array_path(), ".zattrs"),
+            json.dumps({"_ARRAY_DIMENSIONS": ["channel", "time"]}).encode(),
+        )
+        _write_atomic(
+            os.path.join(self._array_path(), ".zarray"),
+            json.dumps(
+                {
+                    "zarr_format": ZARR_FORMAT,
+                    "shape": list(self.shape),
+                    "chunks": list(self.tile_shape),
+                    "dtype": DTYPE.str,
+                    "compressor": {"id": "zlib", "level": self.compression_level},
+                    "fill_value": "NaN",
+                    "order": "C",
+                    "filters": None,
+                }
+            ).encode(),
+        )
+        return self
+
+    def column(self, timestamp: float) -> int:
+        """Get column of `data_down` holding the timestamp."""
+        return int(np.round((timestamp - self.day_start) * self.sps))
+
+    def _tile_path(self, i: int, j: int) -> str:
+        return os.path.join(self._array_path(), f"{i}.{j}")
+
+    def _read_tile(self, i: int, j: int) -> np.ndarray:
+        try:
+            with open(self._tile_path(i, j), "rb") as file:
+                data = zlib.decompress(file.read())
+        except FileNotFoundError:
+            return np.full(self.tile_shape, np.nan, dtype=DTYPE)
+        return np.frombuffer(data, dtype=DTYPE).reshape(self.tile_shape).copy()
+
+    def _tiles(self, start: int, end: int) -> Iterator[Tuple[int, int]]:
+        """Get tiles overlapping columns [start, end)."""
+        tile_channels, tile_samples = self.tile_shape
+        for j in range(start // tile_samples, -(-end // tile_samples)):
+            for i in range(-(-self.channels // tile_channels)):
+                yield i, j
+
+    def write_region(
+        self,
+        start: int,
+        data: np.ndarray,
+        metadata: dict,
+        num_threads: int,
+        executor=None,
+    ) -> None:
+        """Write data to columns starting at `start` and its region metadata.
+
+        Args:
+            start (int): First column of the region.
+            data (np.ndarray): Chunk data (channels, samples).
+            metadata (dict): Region metadata (attrs, summary, ...).
+            num_threads (int): Number of threads compressing and writing tiles.
+            executor (Executor, optional): Shared executor to use instead.
+        """
+        tile_channels, tile_samples = self.tile_shape
+        end = start + data.shape[1]
+        if start < 0 or end > self.shape[1] or data.shape[0] != self.channels:
+            raise ValueError(f"Region {start}:{end} does not fit store {self.path}")
+
+        def write_tile(tile: Tuple[int, int]) -> None:
+            i, j = tile
+            channel_start, column_start = i * tile_channels, j * tile_samples
+            channel_end = min(channel_start + tile_channels, self.channels)
+            begin, stop = max(start, column_start), min(
+                end, column_start + tile_samples
+            )
+            if begin == column_start and stop == column_start + tile_samples:
+                tile_data = np.full(self.tile_shape, np.nan, dtype=DTYPE)
+            else:
+                # Tile shared with a neighbouring region
+                tile_data = self._read_tile(i, j)
+            tile_data[
+                : channel_end - channel_start,
+                begin - column_start : stop - column_start,
+            ] = data[channel_start:channel_end, begin - start : stop - start]
+            _write_atomic(
+                self._tile_path(i, j),
+                zlib.compress(tile_data.tobytes(), self.compression_level),
+            )
+
+        thread_map(write_tile, list(self._tiles(start, end)), num_threads, executor)
+        region = dict(metadata, start=start, samples=data.shape[1], array=self.array)
+        _write_atomic(
+            os.path.join(self.path, "regions", f"{metadata['time']}.json"),
+            json.dumps(region, default=_json_default).encode(),
+        )
+
+    def read(self, start: int, end: int, out: Union[None, np.ndarray] = None):
+        """Read columns [start, end) of the array, NaN where nothing is written.
+
+        Args:
+            start (int): First column.
+            end (int): Column after the last one.
+            out (np.ndarray, optional): Array (channels, end - start) to read into.
+
+        Returns:
+            np.ndarray: Data (channels, end - start).
+        """
+        tile_channels, tile_samples = self.tile_shape
+        if out is None:
+            out = np.empty((self.channels, end - start), dtype=DTYPE)
+        for i, j in self._tiles(start, end):
+            tile_data = self._read_tile(i, j)
+            channel_start, column_start = i * tile_channels, j * tile_samples
+            channel_end = min(channel_start + tile_channels, self.channels)
+            begin, stop = max(start, column_start), min(
+                end, column_start + tile_samples
+            )
+            out[channel_start:channel_end, begin - start : stop - start] = tile_data[
+                : channel_end - channel_start,
+                begin - column_start : stop - column_start,
+            ]
+        return out
+
+    def regions(self) -> list:
+        """Get metadata of the complete regions of all arrays, oldest first."""
+        return self.read_regions(self.path)
+
+    @staticmethod
+    def read_regions(path: str) -> list:
+        """Get metadata of the complete regions of the store at path, oldest first.
+
+        Every region holds the name of its `array` and `mtime_ns` of its file,
+        which changes when the region is rewritten.
+        """
+        regions_path = os.path.join(path, "regions")
+        if not os.path.isdir(regions_path):
+            return []
+        regions = []
+        with os.scandir(regions_path) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    region = json.load(f)
+                region.setdefault("array", ARRAY_NAME)
+                region["mtime_ns"] = entry.stat().st_mtime_ns
+                regions.append(region)
+        return sorted(regions, key=lambda region: region["start"])
+
+    @classmethod
+    def open_existing(cls, path: str, array: str = ARRAY_NAME) -> "DayStore":
+        """Open an array of a store for reading."""
+        with open(os.path.join(path, ".zattrs"), "r", encoding="utf-8") as file:
+            group_attrs = json.load(file)
+        with open(os.path.join(path, array, ".zarray"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            path,
+            group_attrs["day_start"],
+            group_attrs["sps"],
+            meta["shape"][0],
+            tuple(meta["chunks"]),
+            meta["compressor"]["level"],
+            array,
+        )
@@ -0,0 +1,46 @@
+"""HDF5 storage layouts of `data_down` tuned for consumer access patterns."""
+from typing import Union
+
+# Target size of one HDF5 chunk in bytes
+TARGET_CHUNK_BYTES = 1024 * 1024
+ITEM_SIZE = 4  # float32
+
+LAYOUTS = ["contiguous", "time", "custom"]
+
+
+def chunk_shape(
+    layout: str, shape: tuple, custom_shape: Union[None, tuple] = None
+) -> Union[None, tuple]:
+    """Get HDF5 chunk shape of `data_down` for the given layout.
+
+    Layouts:
+        contiguous: no chunking (default). The dataset is (channels, samples),
+            so every channel is already contiguous and this is the fastest for
+            reading few channels over long spans; chunks of whole channels only
+            add chunk lookups (see benchmark_layout.py).
+        time: all channels over a short time window per chunk, for reading all
+            channels over short windows.
+        custom: `custom_shape`.
+
+    Args:
+        layout (str): One of LAYOUTS.
+        shape (tuple): Shape of the dataset (channels, samples).
+        custom_shape (tuple, optional): Chunk shape for the custom layout.
+
+    Returns:
+        tuple: Chunk shape or None for contiguous layout.
+    Raises:
+        ValueError: If layout is not supported.
+    """
+    channels, samples = shape
+    if layout == "contiguous":
+        return None
+    if layout == "time":
+        columns = max(1, TARGET_CHUNK_BYTES // (channels * ITEM_SIZE))
+        chunks = (channels, columns)
+    elif layout == "custom":
+        chunks = tuple(custom_shape)
+    else:
+        raise ValueError(f"HDF5 layout {layout} not supported")
+    # Chunk can not be larger than the (possibly cut) dataset
+    return (max(1, min(chunks[0], channels)), max(1, min(chunks[1], samples)))
@@ -0,0 +1,160 @@
+"""Lease files used to coordinate several concatenation workers on a shared FS."""
+from typing import Union
+import os
+import json
+import socket
+import threading
+import time
+import uuid
+
+from log.main_logger import logger as log
+
+
+class LeaseLostError(Exception):
+    """Raised when a worker no longer holds the lease it is working under."""
+
+
+class Lease:
+    """Exclusive lease stored as a file on the shared filesystem.
+
+    The lease file is created atomically (O_EXCL) and its modification time
+    is used as the heartbeat. A lease whose heartbeat is older than `ttl`
+    seconds is considered stale and may be taken over by another worker.
+
+    Attributes:
+        path (str): Path to the lease file.
+        ttl (float): Seconds without heartbeat after which the lease is stale.
+        heartbeat_interval (float): Seconds between heartbeats.
+        owner (str): Unique identifier of this worker.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float,
+        heartbeat_interval: float,
+        owner: Union[None, str] = None,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.owner = owner or new_owner_id()
+
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Union[None, threading.Thread] = None
+
+    def _read_owner(self, path: str) -> Union[None, str]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)["owner"]
+        except (FileNotFoundError, ValueError, KeyError):
+            # Lease is missing or its creator has not finished writing it yet
+            return None
+
+    def _is_stale(self, path: str) -> bool:
+        try:
+            return time.time() - os.stat(path).st_mtime > self.ttl
+        except FileNotFoundError:
+            return False
+
+    def _create(self) -> bool:
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "owner": self.owner,
+                    "host": socket.gethostname(),
+                    "pid": os.getpid(),
+                    "acquired": time.time(),
+                },
+                f,
+            )
+        return True
+
+    def _break_stale(self) -> None:
+        """Move a stale lease out of the way so it can be acquired again.
+
+        Rename is atomic, so only one worker can move a given lease file. If the
+        file turns out to be fresh (another worker re-acquired it in between),
+        it is moved back and its owner keeps it.
+        """
+        stale_path = f"{self.path}.stale-{self.owner}"
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return
+        if self._is_stale(stale_path):
+            log.warning(
+                "Recovered stale lease %s of %s",
+                self.path,
+                self._read_owner(stale_path),
+            )
+            os.remove(stale_path)
+        else:
+            os.rename(stale_path, self.path)
+
+    def acquire(self) -> bool:
+        """Try to acquire the lease and start the heartbeat.
+
+        Returns:
+            bool: True if the lease is now held by this worker.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not self._create():
+            if not self._is_stale(self.path):
+                return False
+            self._break_stale()
+            if not self._create():
+                return False
+        self.lost.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+        log.debug("Acquired lease %s as %s", self.path, self.owner)
+        return True
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.heartbeat_interval):
+            if self._read_owner(self.path) != self.owner:
+                log.error("Lease %s was taken over by another worker", self.path)
+                self.lost.set()
+                return
+            try:
+                os.utime(self.path)
+            except OSError as err:
+                log.error("Failed to refresh lease %s: %s", self.path, err)
+
+    def check(self) -> None:
+        """Ensure the lease is still held by this worker.
+
+        Raises:
+            LeaseLostError: If the lease expired or was taken over.
+        """
+        if self.lost.is_set() or self._read_owner(self.path) != self.owner:
+            self.lost.set()
+            raise LeaseLostError(f"Lease {self.path} is no longer held")
+
+    def release(self) -> None:
+        """Stop the heartbeat and remove the lease file if it is still ours."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._read_owner(self.path) == self.owner:
+            os.remove(self.path)
+            log.debug("Released lease %s", self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def new_owner_id() -> str:
+    """Build a worker identifier unique across hosts and processes."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
@@ -1,5 +1,5 @@
 """Main module for concatenating H5 files into chunks."""
-from typing import Union, Tuple
+from typing import Callable, Iterator, Union, Tuple
 from datetime import datetime, timedelta
 import os
 import json
@@ -9,29 +9,95 @@ import numpy as np
 import pytz
 
 from log.main_logger import logger as log
-from concat.utils import multithreaded_mean
-from config import (
-    SYSTEM_NAME,
-    CHUNK_SIZE,
-    SPS,
-    DX,
-    LOCAL_PATH,
-    SAVE_PATH,
-)
+from concat.utils import multithreaded_mean, multithreaded_copy
+from concat.tuning import load_tuning
+from concat.layout import chunk_shape, LAYOUTS
+from concat.writer import ChunkWriter, MemoryBudget
+from concat.summary import multithreaded_summary, parse_bands
+from concat.dirstore import DayStore, valid_runs
+from config import Config
 
 
 class Concatenator:
     """Class responsible for concatenating H5 files into chunks.
 
+    Use `run` to write chunks to SAVE_PATH or iterate over `iter_chunks` to
+    consume chunks in-process.
+
     Attributes:
+        config (Config): Concatenation settings.
+        write (bool): Write chunks and state files to SAVE_PATH.
+        io_pool (Executor): Shared executor for reading packets and writing
+            chunks, None to do I/O in the calling thread.
+        cpu_pool (Executor): Shared executor for resampling, copying and
+            summaries, None to use a thread pool per call.
+        include_today (bool): Also read packets of the current UTC day
+            (Mekorot) or directories modified today (Prisma). The newest packet
+            is left for the next run, it may still be being written.
+        position (tuple): Chunk time, data offset and carry after the last
+            chunk yielded without writing. The next `iter_chunks` call on the
+            same instance resumes from it.
         space_samples (int): Number of space samples.
         time_samples (int): Number of time samples.
     """
 
-    def __init__(self, num_threads: int = 4):
+    def __init__(
+        self,
+        config: Config,
+        num_threads: Union[None, int] = None,
+        write: bool = True,
+        io_pool=None,
+        cpu_pool=None,
+        memory_budget: Union[None, MemoryBudget] = None,
+        include_today: bool = False,
+    ):
+        self.config = config
+        self.write = write
+        self.include_today = include_today
+        self.position: Union[None, Tuple[float, int, Union[None, np.ndarray]]] = None
+        self.io_pool = io_pool
+        self.cpu_pool = cpu_pool
+        if write and config.save_path is None:
+            raise ValueError("SAVE_PATH is required to write chunks")
+
         self.space_samples: int = 0
         self.time_samples: int = 0
 
+        self._reset_state()
+
+        self.attrs: dict = {}
+        self.sps: int = 0
+        self.dx: int = 0
+        self.time_seconds: int = 0
+
+        self.system = None
+        # Thread counts measured for this host, see concat/tuning.py
+        tuning = load_tuning(config, num_threads)
+        self.num_threads: int = tuning["resample_threads"]
+        self.resample_splits: int = tuning["resample_splits"]
+        self.copy_threads: int = tuning["copy_threads"]
+        self.copy_splits: int = tuning["copy_splits"]
+        # Directory holding the `last` and `carry.npy` state files (None: no state)
+        self.state_path: Union[None, str] = config.save_path if write else None
+        # Chunk buffers are reused and written to disk in the background
+        self.writer = ChunkWriter(
+            self._write_chunk,
+            num_buffers=self.config.chunk_buffers,
+            memory_budget=memory_budget,
+        )
+        self.summary_bands: list = parse_bands(self.config.summary_bands)
+        if self.config.output_format not in ["hdf5", "zarr"]:
+            raise ValueError(f"Output format {self.config.output_format} not supported")
+        if self.config.hdf5_layout not in LAYOUTS:
+            raise ValueError(f"HDF5 layout {self.config.hdf5_layout} not supported")
+        if (
+            self.config.hdf5_layout == "custom"
+            and len(self.config.hdf5_chunk_shape) != 2
+        ):
+            raise ValueError("HDF5 chunk shape is required for custom layout")
+
+    def _reset_state(self) -> None:
+        """Reset chunk and carry state before processing a new file sequence."""
         self.carry: Union[None, np.ndarray] = None
         self.old_carry: Union[None, np.ndarray] = None
         self.till_next_chunk: int = 0
@@ -43,16 +109,16 @@ class Concatenator:
         self.till_next_day: int = 0
         self.chunk_to_next_day: int = 0
         self.chunk_data_offset: int = 0
+        # Fixed-grid mode: samples of the chunk holding data
+        self.valid: Union[None, np.ndarray] = None
+        # Fixed-grid mode: only samples in [start, end) are written (None: all)
+        self.time_window: Union[None, Tuple[float, float]] = None
 
-        self.attrs: dict = {}
-        self.sps: int = 0
-        self.dx: int = 0
-        self.time_seconds: int = 0
-
-        self.system = None
-        self.num_threads = num_threads
-
-        self.run()
+    def _run_io(self, func: Callable, *args, **kwargs):
+        """Run I/O in the shared I/O pool if there is one."""
+        if self.io_pool is None:
+            return func(*args, **kwargs)
+        return self.io_pool.submit(func, *args, **kwargs).result()
 
     def read_attrs(self, file_path: str) -> dict:
         """Read attributes from json file from working dir.
@@ -67,7 +133,7 @@ class Concatenator:
         """
         try:
             with open(
-                os.path.join(LOCAL_PATH, file_path), "r", encoding="utf-8"
+                os.path.join(self.config.local_path, file_path), "r", encoding="utf-8"
             ) as json_file:
                 attrs = json.load(fp=json_file)
 
@@ -135,7 +201,7 @@ class Concatenator:
                 return_tuple = (file_dir, file_name, data, True)
             else:
                 file_time_diff = int(np.round(next_file_timestamp - file_timestamp, 0))
-                split_before = int(SPS * file_time_diff)
+                split_before = int(self.config.sps * file_time_diff)
                 log.debug(
                     "Cutting data after: %s seconds or %s samples",
                     file_time_diff,
@@ -156,8 +222,8 @@ class Concatenator:
         return return_tuple
 
     def _resample_data(self, data: np.ndarray) -> np.ndarray:
-        if self.sps / SPS >= 2:
-            time_down_factor = int(self.sps / SPS)
+        if self.sps / self.config.sps >= 2:
+            time_down_factor = int(self.sps / self.config.sps)
             log.debug("Resampling time axis by factor %s", time_down_factor)
             self.attrs["down_factor_time"] = time_down_factor
             data = data.reshape(data.shape[0], -1, time_down_factor).copy()
@@ -166,27 +232,31 @@ class Concatenator:
             # data = np.mean(data, axis=-1, dtype=np.float32)
             # data = np.sum(data, axis=-1, dtype=np.float32) / time_down_factor
             # data = multithreaded_sum(data, self.num_threads) / time_down_factor
-            data = multithreaded_mean(data, self.num_threads)
+            data = multithreaded_mean(
+                data, self.num_threads, self.resample_splits, self.cpu_pool
+            )
 
-            self.attrs["prr_down"] = SPS
-            self.sps = SPS
-        if self.dx / DX >= 2:
-            space_down_factor = int(self.dx / DX)
+            self.attrs["prr_down"] = self.config.sps
+            self.sps = self.config.sps
+        if self.dx / self.config.dx >= 2:
+            space_down_factor = int(self.dx / self.config.dx)
             log.debug("Resampling space axis by factor %s", space_down_factor)
             self.attrs["down_factor_space"] = space_down_factor
             data = data[:, ::space_down_factor]
-            self.attrs["dx_down"] = DX
-            self.dx = DX
+            self.attrs["dx_down"] = self.config.dx
+            self.dx = self.config.dx
         return data
 
     def _fill_attrs(self, file_name: str):
-        self.attrs["prr_down"] = SPS
-        self.attrs["dx_down"] = DX
+        self.attrs["prr_down"] = self.config.sps
+        self.attrs["dx_down"] = self.config.dx
 
         self.attrs["packet_time_down"] = self._get_file_timestamp(file_name)
+        if self.config.fixed_grid:
+            self.attrs["fill_value"] = self.config.fill_value
 
     def _data_preprocess(self, data: np.ndarray, file_name: str) -> np.ndarray:
-        if SPS != self.sps or DX != self.dx:
+        if self.config.sps != self.sps or self.config.dx != self.dx:
             log.debug("Resampling data")
             data = self._resample_data(data)
             log.debug("Data shape after resampling: %s", data.shape)
@@ -201,14 +271,17 @@ class Concatenator:
         Returns:
             np.ndarray: The data.
         """
+        data = self._run_io(self._read_packet, file_dir, file_name)
+        return self._data_preprocess(data, file_name)
+
+    def _read_packet(self, file_dir: str, file_name: str) -> np.ndarray:
         file_path = os.path.join(file_dir, file_name)
         if self.system == "Mekorot":
-            data = h5py.File(os.path.join(LOCAL_PATH, file_path), "r")["data_down"][
-                ()
-            ].T
+            with h5py.File(os.path.join(self.config.local_path, file_path), "r") as f:
+                data = f["data_down"][()].T
         elif self.system == "Prisma":
             with open(
-                os.path.join(LOCAL_PATH, file_path),
+                os.path.join(self.config.local_path, file_path),
                 "rb",
             ) as f:
                 f.seek(3714)
@@ -220,40 +293,190 @@ class Concatenator:
                 [("headers", np.void, 240), ("data", "f4", traces)]
             )
             segy_data = np.memmap(
-                os.path.join(LOCAL_PATH, file_path),
+                os.path.join(self.config.local_path, file_path),
                 dtype=mmap_dtype,
                 mode="r",
                 offset=3600,
             )
             log.debug("SEGY data shape: %s", segy_data["data"].shape)
             data = segy_data["data"]
+        return data
 
-        return self._data_preprocess(data, file_name)
+    def _save_chunk_data(self, chunk_data: np.ndarray, buffer: np.ndarray) -> None:
+        """Queue chunk data for writing together with a snapshot of the state.
 
-    def _save_chunk_data(self, chunk_data: np.ndarray) -> None:
+        Args:
+            chunk_data (np.ndarray): The chunk data (view of `buffer`).
+            buffer (np.ndarray): Chunk buffer, reused once the chunk is written.
+        """
         log.info("Saving chunk data to %s.h5", self.chunk_time_str)
         log.info("Chunk data shape: %s", chunk_data.shape)
+        self.writer.submit(
+            chunk_data,
+            buffer,
+            chunk_time=self.chunk_time,
+            chunk_time_str=self.chunk_time_str,
+            chunk_data_offset=self.chunk_data_offset,
+            attrs=dict(self.attrs),
+            carry=self.carry,
+            state_path=self.state_path,
+            valid=self.valid,
+        )
+
+    def _write_chunk(
+        self,
+        chunk_data: np.ndarray,
+        chunk_time: float,
+        chunk_time_str: str,
+        chunk_data_offset: int,
+        attrs: dict,
+        carry: Union[None, np.ndarray],
+        state_path: str,
+        valid: Union[None, np.ndarray] = None,
+    ) -> None:
+        """Write chunk data to h5 file and update the state files.
+
+        Runs in the writer thread, so it uses only the passed state snapshot.
+        """
+        summary = None
+        if self.config.summary_enabled:
+            summary_data = chunk_data
+            if valid is not None and not valid.all():
+                # Fill values would dominate RMS and band energy
+                summary_data = chunk_data[:, valid[: chunk_data.shape[1]]]
+            summary = multithreaded_summary(
+                summary_data,
+                self.config.sps,
+                self.summary_bands,
+                self.config.dead_channel_ratio,
+                self.num_threads,
+                self.cpu_pool,
+            )
+        self._run_io(
+            self._write_chunk_files,
+            chunk_data,
+            summary,
+            chunk_time,
+            chunk_time_str,
+            chunk_data_offset,
+            attrs,
+            carry,
+            state_path,
+            valid,
+        )
+
+    def _write_chunk_files(
+        self,
+        chunk_data: np.ndarray,
+        summary: Union[None, dict],
+        chunk_time: float,
+        chunk_time_str: str,
+        chunk_data_offset: int,
+        attrs: dict,
+        carry: Union[None, np.ndarray],
+        state_path: str,
+        valid: Union[None, np.ndarray] = None,
+    ) -> None:
+        if self.config.output_format == "zarr":
+            self._write_store_region(
+                chunk_data, summary, chunk_time, chunk_time_str, attrs, valid
+            )
+        else:
+            self._write_h5_file(chunk_data, summary, chunk_time_str, attrs, valid)
+        if carry is None and os.path.exists(os.path.join(state_path, "carry.npy")):
+            # Carry of an earlier chunk, it must not be loaded after this one
+            os.remove(os.path.join(state_path, "carry.npy"))
+            log.debug("Removing stale carry file")
+        if os.path.exists(os.path.join(state_path, "last")):
+            os.remove(os.path.join(state_path, "last"))
+            log.debug("Removing last after saving chunk data")
+
+        with open(os.path.join(state_path, "last"), "w", encoding="utf-8") as f:
+            f.writelines([f"{chunk_time}\n", f"{chunk_data_offset}\n"])
+        if carry is not None:
+            log.debug("Saving carry data to carry file")
+            np.save(os.path.join(state_path, "carry.npy"), carry)
+
+    def _write_h5_file(
+        self,
+        chunk_data: np.ndarray,
+        summary: Union[None, dict],
+        chunk_time_str: str,
+        attrs: dict,
+        valid: Union[None, np.ndarray],
+    ) -> None:
         date_datetime = datetime.fromtimestamp(
-            float(self.chunk_time_str), tz=pytz.UTC
+            float(chunk_time_str), tz=pytz.UTC
         ).date()
         year = date_datetime.strftime("%Y")
         date = date_datetime.strftime("%Y%m%d")
-        save_path = os.path.join(SAVE_PATH, year, date)
-        if not os.path.exists(save_path):
-            os.makedirs(os.path.join(SAVE_PATH, year, date))
-        file = h5py.File(os.path.join(save_path, self.chunk_time_str + ".h5"), "w")
-        file["data_down"] = chunk_data
-
-        file.attrs.update(self.attrs)
-        if os.path.exists(os.path.join(SAVE_PATH, "last")):
-            os.remove(os.path.join(SAVE_PATH, "last"))
-            log.debug("Removing last after saving chunk data")
+        save_path = os.path.join(self.config.save_path, year, date)
+        os.makedirs(save_path, exist_ok=True)
+        with h5py.File(
+            os.path.join(save_path, chunk_time_str + ".h5"),
+            "w",
+            rdcc_nbytes=self.config.hdf5_cache_bytes,
+        ) as file:
+            file.create_dataset(
+                "data_down",
+                data=chunk_data,
+                chunks=chunk_shape(
+                    self.config.hdf5_layout,
+                    chunk_data.shape,
+                    self.config.hdf5_chunk_shape,
+                ),
+            )
+            file.attrs.update(attrs)
+            if valid is not None:
+                # Mostly long runs, compresses to a few bytes
+                file.create_dataset(
+                    "valid", data=valid[: chunk_data.shape[1]], compression="gzip"
+                )
+            if summary is not None:
+                summary_group = file.create_group("summary")
+                for name, value in summary.items():
+                    summary_group[name] = value
+                summary_group.attrs["bands"] = np.array(self.summary_bands)
+        log.debug("Chunk data written to %s.h5", chunk_time_str)
+
+    def _day_store(self, chunk_time: float, channels: int) -> DayStore:
+        tile_shape = (
+            min(self.config.tile_channels, channels),
+            max(1, int(self.config.tile_seconds * self.config.sps)),
+        )
+        return DayStore.for_timestamp(
+            self.config.save_path,
+            chunk_time,
+            self.config.sps,
+            channels,
+            tile_shape,
+            self.config.compression_level,
+        )
 
-        with open(os.path.join(SAVE_PATH, "last"), "w", encoding="utf-8") as f:
-            f.writelines([f"{self.chunk_time}\n", f"{self.chunk_data_offset}\n"])
-        if self.carry is not None:
-            log.debug("Saving carry data to carry file")
-            np.save(os.path.join(SAVE_PATH, "carry.npy"), self.carry)
+    def _write_store_region(
+        self,
+        chunk_data: np.ndarray,
+        summary: Union[None, dict],
+        chunk_time: float,
+        chunk_time_str: str,
+        attrs: dict,
+        valid: Union[None, np.ndarray],
+    ) -> None:
+        store = self._day_store(chunk_time, chunk_data.shape[0]).open()
+        metadata = {"time": chunk_time_str, "attrs": attrs}
+        if valid is not None:
+            metadata["valid"] = valid_runs(valid[: chunk_data.shape[1]])
+        if summary is not None:
+            metadata["summary"] = dict(summary, bands=self.summary_bands)
+        # Tiles are compressed on the CPU pool, the write itself may run on the I/O pool
+        store.write_region(
+            store.column(chunk_time),
+            chunk_data,
+            metadata,
+            self.config.write_threads,
+            self.cpu_pool,
+        )
+        log.debug("Chunk data written to %s region %s", store.path, chunk_time_str)
 
     def _calculate_attrs(self, file_dir, file_name) -> None:
         """Calculate the attributes based on the file path.
@@ -271,7 +494,7 @@ class Concatenator:
                 .replace("das_SR_", "")
             )
             log.debug("Calculating attrs for %s", file_path)
-            if os.path.exists(os.path.join(LOCAL_PATH, file_path)):
+            if os.path.exists(os.path.join(self.config.local_path, file_path)):
                 self.attrs = self.read_attrs(file_path)
             else:
                 file_path = os.path.join(file_path.rsplit(os.sep, 1)[0], "attrs.json")
@@ -296,8 +519,10 @@ class Concatenator:
             self.sps = self.attrs["prr"]
             self.dx = self.attrs["dx"]
             self.space_samples = self.attrs["numSamplesPerTrace"]
-            self.time_samples = int(self.attrs["numTraces"] / (self.sps / SPS))
-            self.time_seconds = self.time_samples / SPS
+            self.time_samples = int(
+                self.attrs["numTraces"] / (self.sps / self.config.sps)
+            )
+            self.time_seconds = self.time_samples / self.config.sps
 
         self._fill_attrs(file_name)
         log.debug("Expected data shape: %s, %s", self.space_samples, self.time_samples)
@@ -307,29 +532,41 @@ class Concatenator:
         return chunk_data[:, : self.chunk_data_offset]
 
     def _get_previous_file_data(self):
-        if os.path.exists(os.path.join(SAVE_PATH, "last")):
-            with open(os.path.join(SAVE_PATH, "last"), "r", encoding="utf-8") as f:
+        if self.state_path is None and self.position is not None:
+            # Chunks yielded by a previous call are not restored, new packets
+            # start a new chunk
+            chunk_time, chunk_data_offset, self.carry = self.position
+            log.debug("Resuming after chunk %s", chunk_time)
+            return chunk_time, chunk_data_offset
+        if self.state_path is not None and os.path.exists(
+            os.path.join(self.state_path, "last")
+        ):
+            with open(
+                os.path.join(self.state_path, "last"), "r", encoding="utf-8"
+            ) as f:
                 chunk_time, chunk_data_offset = [x.strip() for x in f.readlines()]
                 chunk_data_offset = int(chunk_data_offset)
                 chunk_time = float(chunk_time)
                 chunk_datetime = datetime.fromtimestamp(chunk_time, tz=pytz.UTC)
-                chunk_end_time = chunk_time + (chunk_data_offset / SPS)
+                chunk_end_time = chunk_time + (chunk_data_offset / self.config.sps)
                 next_day = (
                     chunk_datetime.replace(hour=0, minute=0, second=0, microsecond=0)
                     + timedelta(days=1)
                 ).timestamp()
                 if (
-                    chunk_data_offset == int(CHUNK_SIZE * SPS)
+                    chunk_data_offset == int(self.config.chunk_size * self.config.sps)
                     or chunk_end_time >= next_day
                 ):
                     log.debug("Skipping restoration")
                     log.debug("Chunk time %s", chunk_time)
                     log.debug("Loading carry data")
-                    if os.path.exists(os.path.join(SAVE_PATH, "carry.npy")):
+                    if os.path.exists(os.path.join(self.state_path, "carry.npy")):
                         log.debug("Loading carry data")
-                        self.old_carry = np.load(os.path.join(SAVE_PATH, "carry.npy"))
+                        self.old_carry = np.load(
+                            os.path.join(self.state_path, "carry.npy")
+                        )
                         self.carry = self.old_carry
-                        os.remove(os.path.join(SAVE_PATH, "carry.npy"))
+                        os.remove(os.path.join(self.state_path, "carry.npy"))
                         log.debug("Removing carry file")
                     else:
                         self.carry = None
@@ -348,39 +585,79 @@ class Concatenator:
         return chunk_time, chunk_data_offset
 
     def _allocate_empty_chunk(self):
-        chunk_data = np.empty(
-            (self.space_samples, int(CHUNK_SIZE * SPS)), dtype=np.float32
+        chunk_data = self.writer.get_buffer(
+            (self.space_samples, int(self.config.chunk_size * self.config.sps))
         )
         self.chunk_data_offset = 0
-        self.till_next_chunk = CHUNK_SIZE
+        self.till_next_chunk = self.config.chunk_size
         self.new_chunk = True
         log.debug("New chunk data has shape: %s", chunk_data.shape)
         return chunk_data
 
-    def _restore_previous_chunk(self, previous_chunk_time, previous_chunk_data_offset):
-        previous_chunk_time = float(previous_chunk_time)
-        chunk_datetime = datetime.fromtimestamp(previous_chunk_time, tz=pytz.UTC).date()
-        chunk_date = chunk_datetime.strftime("%Y%m%d")
-        chunk_year = chunk_datetime.strftime("%Y")
+    def _read_h5_chunk(
+        self, chunk_time: float, chunk_data: np.ndarray, chunk_data_offset: int
+    ) -> None:
+        chunk_datetime = datetime.fromtimestamp(chunk_time, tz=pytz.UTC).date()
         chunk_path = os.path.join(
-            SAVE_PATH, chunk_year, chunk_date, str(previous_chunk_time) + ".h5"
+            self.config.save_path,
+            chunk_datetime.strftime("%Y"),
+            chunk_datetime.strftime("%Y%m%d"),
+            str(chunk_time) + ".h5",
         )
         log.debug("Loading chunk data from %s", chunk_path)
+        with h5py.File(
+            chunk_path, "r", rdcc_nbytes=self.config.hdf5_cache_bytes
+        ) as file:
+            restored_samples = file["data_down"].shape[1]
+            file["data_down"].read_direct(
+                chunk_data, dest_sel=np.s_[:, :restored_samples]
+            )
+            if self.config.fixed_grid:
+                chunk_data[:, restored_samples:] = self.config.fill_value
+                self.valid = np.zeros(chunk_data.shape[1], dtype=bool)
+                if "valid" in file:
+                    self.valid[:restored_samples] = file["valid"][()]
+                else:
+                    self.valid[:chunk_data_offset] = True
+
+    def _read_store_region(
+        self, chunk_time: float, chunk_data: np.ndarray, chunk_data_offset: int
+    ) -> None:
+        store = self._day_store(chunk_time, chunk_data.shape[0]).open()
+        region_path = os.path.join(store.path, "regions", f"{chunk_time}.json")
+        log.debug("Loading chunk data from %s", region_path)
+        with open(region_path, "r", encoding="utf-8") as f:
+            region = json.load(f)
+        restored_samples = region["samples"]
+        store.read(
+            region["start"],
+            region["start"] + restored_samples,
+            out=chunk_data[:, :restored_samples],
+        )
+        if self.config.fixed_grid:
+            chunk_data[:, restored_samples:] = self.config.fill_value
+            self.valid = np.zeros(chunk_data.shape[1], dtype=bool)
+            if "valid" in region:
+                for run_start, run_end in region["valid"]:
+                    self.valid[run_start:run_end] = True
+            else:
+                self.valid[:chunk_data_offset] = True
+
+    def _restore_previous_chunk(self, previous_chunk_time, previous_chunk_data_offset):
+        previous_chunk_time = float(previous_chunk_time)
         try:
-            chunk_data: np.ndarray = h5py.File(chunk_path, "r")["data_down"][()]
-            # Resize chunk to SPS * CHUNK_SIZE
-            chunk_data = np.hstack(
-                (
-                    chunk_data,
-                    np.zeros(
-                        (
-                            self.space_samples,
-                            int((SPS * CHUNK_SIZE) - chunk_data.shape[1]),
-                        ),
-                        dtype=np.float32,
-                    ),
-                )
+            # Read chunk into a buffer of size SPS * CHUNK_SIZE
+            chunk_data = self.writer.get_buffer(
+                (self.space_samples, int(self.config.sps * self.config.chunk_size))
             )
+            if self.config.output_format == "zarr":
+                self._read_store_region(
+                    previous_chunk_time, chunk_data, previous_chunk_data_offset
+                )
+            else:
+                self._read_h5_chunk(
+                    previous_chunk_time, chunk_data, previous_chunk_data_offset
+                )
 
             log.debug("Chunk data shape: %s", chunk_data.shape)
 
@@ -420,12 +697,15 @@ class Concatenator:
             today = datetime.now(tz=pytz.UTC).date().strftime("%Y%m%d")
             dirs = [
                 dir
-                for dir in os.listdir(LOCAL_PATH)
-                if os.path.isdir(os.path.join(LOCAL_PATH, dir)) and dir != today
+                for dir in os.listdir(self.config.local_path)
+                if os.path.isdir(os.path.join(self.config.local_path, dir))
+                and (self.include_today or dir != today)
             ]
 
             for dir_path in sorted(dirs):
-                for root, dirs, files in os.walk(os.path.join(LOCAL_PATH, dir_path)):
+                for root, dirs, files in os.walk(
+                    os.path.join(self.config.local_path, dir_path)
+                ):
                     files = [file for file in files if file.endswith(".h5")]
                     for file in sorted(
                         files, key=lambda x: int(x.split("_")[-1].split(".")[0])
@@ -433,7 +713,7 @@ class Concatenator:
                         if file.endswith(".h5") and float(
                             file.split("_")[-1].rsplit(".", 1)[0]
                         ) >= np.floor(previous_chunk_time) + (
-                            previous_chunk_data_offset / SPS
+                            previous_chunk_data_offset / self.config.sps
                         ):
                             h5_files_list.append([dir_path, file])
         elif self.system == "Prisma":
@@ -442,18 +722,24 @@ class Concatenator:
             )
             dirs = [
                 dir
-                for dir in os.listdir(LOCAL_PATH)
+                for dir in os.listdir(self.config.local_path)
                 if (
-                    os.path.isdir(os.path.join(LOCAL_PATH, dir))
-                    and os.path.getmtime(os.path.join(LOCAL_PATH, dir))
-                    < today.timestamp()
+                    os.path.isdir(os.path.join(self.config.local_path, dir))
+                    and (
+                        self.include_today
+                        or os.path.getmtime(os.path.join(self.config.local_path, dir))
+                        < today.timestamp()
+                    )
                 )
             ]
 
             for dir_path in sorted(
-                dirs, key=lambda x: os.path.getmtime(os.path.join(LOCAL_PATH, x))
+                dirs,
+                key=lambda x: os.path.getmtime(os.path.join(self.config.local_path, x)),
             ):
-                for root, dirs, files in os.walk(os.path.join(LOCAL_PATH, dir_path)):
+                for root, dirs, files in os.walk(
+                    os.path.join(self.config.local_path, dir_path)
+                ):
                     files = [file for file in files if file.endswith(".segy")]
                     for file in sorted(
                         files, key=lambda x: self._get_file_timestamp(x)
@@ -461,11 +747,14 @@ class Concatenator:
                         file_timestamp = self._get_file_timestamp(file)
                         if file.endswith(".segy") and file_timestamp >= np.floor(
                             previous_chunk_time
-                        ) + (previous_chunk_data_offset / SPS):
+                        ) + (previous_chunk_data_offset / self.config.sps):
                             h5_files_list.append([dir_path, file])
         # FIFO: reverse list
         log.debug("Files to process: %s", len(h5_files_list))
         h5_files_list = h5_files_list[::-1]
+        if self.include_today:
+            # The newest packet may still be being written
+            h5_files_list = h5_files_list[1:]
         return h5_files_list
 
     def _get_file_timestamp(self, file_name: str):
@@ -491,7 +780,9 @@ class Concatenator:
     ):
         log.debug("Filling chunk data")
         while True:
-            self.till_next_chunk = CHUNK_SIZE - self.chunk_data_offset / SPS
+            self.till_next_chunk = (
+                self.config.chunk_size - self.chunk_data_offset / self.config.sps
+            )
             # Get next file data
             file_dir, file_name, data, is_chunk_stop = self._get_next_packet_data(
                 h5_files_list
@@ -515,14 +806,30 @@ class Concatenator:
                 continue
             log.debug("Concatenating %s", file_name)
             if self.new_chunk:
+                carry_gap = False
                 if self.carry is not None:
                     log.debug("Previous time: %s", previous_chunk_time)
                     log.debug("Previous offset: %s", previous_chunk_data_offset)
                     log.debug("Loaded time from carry data")
                     self.chunk_time = float(
-                        previous_chunk_time + (previous_chunk_data_offset / SPS)
+                        previous_chunk_time
+                        + (previous_chunk_data_offset / self.config.sps)
+                    )
+                    carry_gap = (
+                        np.floor(
+                            self._get_file_timestamp(file_name)
+                            - self.chunk_time
+                            - self.carry.shape[1] / self.config.sps
+                        )
+                        > 0
+                    )
+                    multithreaded_copy(
+                        chunk_data[:, : self.carry.shape[1]],
+                        self.carry,
+                        self.copy_threads,
+                        self.copy_splits,
+                        self.cpu_pool,
                     )
-                    chunk_data[:, : self.carry.shape[1]] = self.carry
                     self.chunk_data_offset = self.carry.shape[1]
                     self.carry = None
                 else:
@@ -563,8 +870,16 @@ class Concatenator:
                 ).date()
                 year = date_datetime.strftime("%Y")
                 date = date_datetime.strftime("%Y%m%d")
-                if not os.path.exists(os.path.join(SAVE_PATH, year, date)):
-                    os.makedirs(os.path.join(SAVE_PATH, year, date))
+                if self.write and self.config.output_format == "hdf5":
+                    os.makedirs(
+                        os.path.join(self.config.save_path, year, date), exist_ok=True
+                    )
+                if carry_gap:
+                    # Packet after the carry is not contiguous, chunk ends with carry
+                    log.warning(
+                        "Gap after carry data, ending chunk before %s", file_name
+                    )
+                    break
 
                 # with open(
                 #     os.path.join(SAVE_PATH, year, date, self.chunk_time_str + ".json"),
@@ -650,12 +965,18 @@ class Concatenator:
 
                 raise ValueError("Inconsistency between chunk time and packet time")
 
-            chunk_data[
-                :,
-                self.chunk_data_offset : self.chunk_data_offset
-                + end_split_index
-                - start_split_index,
-            ] = data
+            multithreaded_copy(
+                chunk_data[
+                    :,
+                    self.chunk_data_offset : self.chunk_data_offset
+                    + end_split_index
+                    - start_split_index,
+                ],
+                data,
+                self.copy_threads,
+                self.copy_splits,
+                self.cpu_pool,
+            )
             self.chunk_data_offset += end_split_index - start_split_index
             chunk_time_current = self.chunk_time + (self.chunk_data_offset / self.sps)
 
@@ -671,19 +992,180 @@ class Concatenator:
                 break
         return chunk_data
 
-    def _concat_files(self) -> Tuple[bool, Union[Exception, None]]:
+    def _grid_chunk_bounds(self, timestamp: float) -> Tuple[float, float]:
+        """Get start and end of the fixed-grid chunk containing the timestamp.
+
+        Grid chunks start at multiples of CHUNK_SIZE from UTC midnight, the last
+        chunk of a day is cut at midnight.
+        """
+        day_start = datetime.fromtimestamp(timestamp, tz=pytz.UTC).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        chunk_index = (timestamp - day_start.timestamp()) // self.config.chunk_size
+        chunk_start = day_start.timestamp() + chunk_index * self.config.chunk_size
+        chunk_end = min(
+            chunk_start + self.config.chunk_size,
+            (day_start + timedelta(days=1)).timestamp(),
+        )
+        return chunk_start, chunk_end
+
+    def _allocate_grid_chunk(self, chunk_start: float, space_samples: int):
+        chunk_data = self.writer.get_buffer(
+            (space_samples, int(self.config.chunk_size * self.config.sps))
+        )
+        chunk_data.fill(self.config.fill_value)
+        self.valid = np.zeros(chunk_data.shape[1], dtype=bool)
+        self.chunk_time = chunk_start
+        self.chunk_time_str = str(chunk_start)
+        self.chunk_data_offset = 0
+        log.debug("New grid chunk %s", self.chunk_time_str)
+        return chunk_data
+
+    def _clip_to_window(
+        self, data: np.ndarray, position: float
+    ) -> Tuple[np.ndarray, float]:
+        """Drop packet samples outside of `time_window`."""
+        window_start, window_end = self.time_window
+        first = max(0, int(np.round((window_start - position) * self.config.sps)))
+        last = max(first, int(np.round((window_end - position) * self.config.sps)))
+        return data[:, first:last], position + first / self.config.sps
+
+    def _emit_chunk(
+        self, chunk_data: np.ndarray, chunk_buffer: np.ndarray
+    ) -> Iterator[Tuple[float, np.ndarray, dict]]:
+        attrs = dict(self.attrs)
+        if self.valid is not None:
+            attrs["valid"] = self.valid[: chunk_data.shape[1]]
+        if self.write:
+            # Save chunk data to h5 file (in the background)
+            try:
+                self._save_chunk_data(chunk_data, chunk_buffer)
+            except BaseException:
+                # Not submitted, the writer will never return it to the pool
+                self.writer.release(chunk_buffer)
+                raise
+        else:
+            self.position = (self.chunk_time, self.chunk_data_offset, self.carry)
+        yield self.chunk_time, chunk_data, attrs
+        if not self.write:
+            self.writer.release(chunk_buffer)
+
+    def _emit_grid_chunk(
+        self, chunk_buffer: np.ndarray
+    ) -> Iterator[Tuple[float, np.ndarray, dict]]:
+        chunk_start, chunk_end = self._grid_chunk_bounds(self.chunk_time)
+        chunk_samples = int(np.round((chunk_end - chunk_start) * self.config.sps))
+        log.debug(
+            "Grid chunk %s has %s of %s samples",
+            self.chunk_time_str,
+            np.count_nonzero(self.valid[:chunk_samples]),
+            chunk_samples,
+        )
+        yield from self._emit_chunk(chunk_buffer[:, :chunk_samples], chunk_buffer)
+
+    def _concat_files_grid(self) -> Iterator[Tuple[float, np.ndarray, dict]]:
+        """Concatenate packets into fixed-grid chunks.
+
+        Every packet sample goes to the grid position given by the packet
+        timestamp, samples no packet covers keep the fill value. Chunks without
+        any packet are not written, so the file and offset of a timestamp are
+        known without reading the archive.
+
+        Yields:
+            tuple: chunk time, chunk data and attrs of every completed chunk.
+        """
+        previous_chunk_time, previous_chunk_data_offset = self._get_previous_file_data()
+        h5_files_list = self._get_files(previous_chunk_time, previous_chunk_data_offset)
+        if len(h5_files_list) == 0:
+            log.warning("No new files found in %s", self.config.local_path)
+            return
+
+        chunk_buffer = None
+        if self.restored:
+            self._calculate_attrs(h5_files_list[-1][0], h5_files_list[-1][1])
+            chunk_buffer = self._restore_previous_chunk(
+                previous_chunk_time, previous_chunk_data_offset
+            )
+
+        while len(h5_files_list) > 0:
+            file_dir, file_name, data, _ = self._get_next_packet_data(h5_files_list)
+            h5_files_list.pop()
+            position = self._get_file_timestamp(file_name)
+            if self.time_window is not None:
+                data, position = self._clip_to_window(data, position)
+
+            # A packet can span several grid chunks
+            while data.shape[1] > 0:
+                chunk_start, chunk_end = self._grid_chunk_bounds(
+                    position + 0.5 / self.config.sps
+                )
+                if (
+                    chunk_buffer is not None
+                    and chunk_start == self.chunk_time
+                    and data.shape[0] != chunk_buffer.shape[0]
+                ):
+                    # A grid slot has a single file: keep the data already in the
+                    # slot and drop the packet samples with the new geometry
+                    skip = max(
+                        1, int(np.round((chunk_end - position) * self.config.sps))
+                    )
+                    log.error(
+                        "Data shape mismatch: %s, %s, dropping %s samples of %s in grid chunk %s",
+                        data.shape[0],
+                        chunk_buffer.shape[0],
+                        min(skip, data.shape[1]),
+                        file_name,
+                        self.chunk_time_str,
+                    )
+                    data = data[:, skip:]
+                    position += skip / self.config.sps
+                    continue
+                if chunk_buffer is not None and chunk_start != self.chunk_time:
+                    yield from self._emit_grid_chunk(chunk_buffer)
+                    chunk_buffer = None
+                if chunk_buffer is None:
+                    chunk_buffer = self._allocate_grid_chunk(chunk_start, data.shape[0])
+
+                chunk_samples = int(
+                    np.round((chunk_end - chunk_start) * self.config.sps)
+                )
+                start = max(
+                    0, int(np.round((position - chunk_start) * self.config.sps))
+                )
+                count = max(0, min(data.shape[1], chunk_samples - start))
+                multithreaded_copy(
+                    chunk_buffer[:, start : start + count],
+                    data[:, :count],
+                    self.copy_threads,
+                    self.copy_splits,
+                    self.cpu_pool,
+                )
+                self.valid[start : start + count] = True
+                self.chunk_data_offset = max(self.chunk_data_offset, start + count)
+                data = data[:, count:]
+                position = chunk_start + (start + count) / self.config.sps
+
+        if chunk_buffer is not None:
+            yield from self._emit_grid_chunk(chunk_buffer)
+        # Wait for the background writer, state files must be up to date on return
+        self.writer.flush()
+
+    def _concat_files(self) -> Iterator[Tuple[float, np.ndarray, dict]]:
         """Main entry point to packet concatenation.
 
-        Returns:
-            tuple: containing the status (bool) and the error (Exception or None).
+        Yields:
+            tuple: chunk time, chunk data and attrs of every completed chunk.
         """
+        if self.config.fixed_grid:
+            yield from self._concat_files_grid()
+            return
         previous_chunk_time, previous_chunk_data_offset = self._get_previous_file_data()
         # Getting all necessary environmental vars from status file (if exists)
         #  otherwise return default values
         h5_files_list = self._get_files(previous_chunk_time, previous_chunk_data_offset)
 
         if len(h5_files_list) == 0:
-            log.warning("No new files found in %s", LOCAL_PATH)
+            log.warning("No new files found in %s", self.config.local_path)
             return
         # Check if there is a gap between last chunk and first file
         first_file_time = h5_files_list[-1][1]
@@ -693,46 +1175,79 @@ class Concatenator:
                 self._get_file_timestamp(first_file_time)
                 - float(
                     previous_chunk_time
-                    + (previous_chunk_data_offset / SPS)
-                    + (self.carry.shape[1] / SPS)
+                    + (previous_chunk_data_offset / self.config.sps)
+                    + (self.carry.shape[1] / self.config.sps)
                 )
             )
             if time_diff > 0:
                 log.warning("Gap between last chunk and first file: %s", time_diff)
                 self.carry = None
+        elif self.restored:
+            time_diff = np.floor(
+                self._get_file_timestamp(first_file_time)
+                - float(
+                    previous_chunk_time + (previous_chunk_data_offset / self.config.sps)
+                )
+            )
+            if time_diff > 0:
+                # Keep the partial chunk as written, new packets start a new chunk
+                log.warning("Gap between last chunk and first file: %s", time_diff)
+                self.restored = False
 
         while len(h5_files_list) > 0:
             start_time = datetime.now(tz=pytz.UTC)
             self._calculate_attrs(h5_files_list[-1][0], h5_files_list[-1][1])
 
-            chunk_data = self._get_chunk_data(
+            chunk_buffer = self._get_chunk_data(
                 previous_chunk_time, previous_chunk_data_offset
             )
 
             chunk_data = self._fill_chunk_data(
                 h5_files_list,
-                chunk_data,
+                chunk_buffer,
                 previous_chunk_time,
                 previous_chunk_data_offset,
             )
             # Cut chunk data to size
             chunk_data = self._cut_chunk_to_size(chunk_data)
-            # Save chunk data to h5 file
-            self._save_chunk_data(chunk_data)
+            yield from self._emit_chunk(chunk_data, chunk_buffer)
 
             previous_chunk_time = self.chunk_time
             previous_chunk_data_offset = self.chunk_data_offset
             log.info(
                 "Chunk processing time: %s", datetime.now(tz=pytz.UTC) - start_time
             )
+        # Wait for the background writer, state files must be up to date on return
+        self.writer.flush()
         return
 
+    def _check_system(self) -> None:
+        if self.config.system_name not in ["Mekorot", "Prisma"]:
+            raise ValueError("System not supported")
+        self.system = self.config.system_name
+
+    def iter_chunks(self) -> Iterator[Tuple[float, np.ndarray, dict]]:
+        """Concatenate packets, yielding chunks as they complete.
+
+        Chunks are written to SAVE_PATH as well if `write` is set. Without
+        writing, another call resumes after the last chunk yielded by this one.
+
+        Yields:
+            tuple: chunk time (UTC timestamp), chunk data (channels, samples) and
+                attrs. The chunk data buffer is reused, copy it to keep it after
+                requesting the next chunk. In fixed-grid mode attrs["valid"]
+                marks the samples holding data.
+        """
+        self._check_system()
+        try:
+            yield from self._concat_files()
+        finally:
+            self.writer.close()
+
     def run(self):
         """Main entry point to the concatenation process."""
-        if SYSTEM_NAME not in ["Mekorot", "Prisma"]:
-            raise ValueError("System not supported")
-        self.system = SYSTEM_NAME
         start_time = datetime.now(tz=pytz.UTC)
         log.info("Starting concatenation at %s", start_time)
-        self._concat_files()
+        for _ in self.iter_chunks():
+            pass
         log.info("Finished in %s", datetime.now(tz=pytz.UTC) - start_time)
@@ -0,0 +1,190 @@
+"""Service concatenating several DAS sources on shared, bounded worker pools."""
+from typing import Callable, Union
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+import threading
+
+import pytz
+
+from log.main_logger import logger as log
+from concat.main import Concatenator
+from concat.writer import MemoryBudget
+from config import Config
+
+
+class FairScheduler:
+    """Bounded thread pool serving per-source queues in round-robin order.
+
+    A source submitting a burst of tasks does not delay the other sources: the
+    workers take one task from every source with pending work in turn.
+
+    Attributes:
+        name (str): Name of the pool (for thread names).
+        num_threads (int): Number of worker threads.
+    """
+
+    def __init__(self, name: str, num_threads: int):
+        self.name = name
+        self.num_threads = max(num_threads, 1)
+
+        self._queues: dict = {}
+        self._ready: deque = deque()
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            for i in range(self.num_threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, source: str, func: Callable, *args, **kwargs) -> Future:
+        """Queue a task of the given source.
+
+        Returns:
+            Future: Result of the task.
+        """
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError(f"{self.name} pool is shut down")
+            source_queue = self._queues.setdefault(source, deque())
+            if not source_queue:
+                self._ready.append(source)
+            source_queue.append((future, func, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def _worker(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._ready or self._shutdown)
+                if not self._ready:
+                    return
+                source = self._ready.popleft()
+                future, func, args, kwargs = self._queues[source].popleft()
+                if self._queues[source]:
+                    # Back of the line, other sources go first
+                    self._ready.append(source)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as err:
+                future.set_exception(err)
+
+    def for_source(self, source: str) -> "SourceExecutor":
+        """Get executor submitting tasks on behalf of the source."""
+        return SourceExecutor(self, source)
+
+    def shutdown(self) -> None:
+        """Finish queued tasks and stop the workers."""
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+class SourceExecutor:
+    """Executor-like view of a FairScheduler bound to one source."""
+
+    def __init__(self, scheduler: FairScheduler, source: str):
+        self.scheduler = scheduler
+        self.source = source
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        return self.scheduler.submit(self.source, func, *args, **kwargs)
+
+    def map(self, func: Callable, *iterables):
+        futures = [self.submit(func, *args) for args in zip(*iterables)]
+        return (future.result() for future in futures)
+
+
+class ConcatService:
+    """Concatenate several sources sharing I/O and CPU pools and a memory budget.
+
+    Every source is driven by its own lightweight thread, while reading packets,
+    writing chunks, resampling and copying run on the shared pools.
+
+    Attributes:
+        sources (dict): Source name to its Config.
+        io_threads (int): Number of threads reading packets and writing chunks.
+        cpu_threads (int): Number of threads resampling and copying data.
+        memory_budget (MemoryBudget): Memory limit for chunk buffers of all
+            sources, None for no limit.
+    """
+
+    def __init__(
+        self,
+        sources: dict,
+        io_threads: int = 4,
+        cpu_threads: int = 4,
+        memory_budget_bytes: Union[None, int] = None,
+        num_threads: Union[None, int] = None,
+    ):
+        self.sources = sources
+        self.io_threads = io_threads
+        self.cpu_threads = cpu_threads
+        self.num_threads = num_threads
+        self.memory_budget = (
+            MemoryBudget(memory_budget_bytes) if memory_budget_bytes else None
+        )
+        self.errors: dict = {}
+
+    def _run_source(
+        self,
+        name: str,
+        config: Config,
+        io_pool: FairScheduler,
+        cpu_pool: FairScheduler,
+    ) -> None:
+        start_time = datetime.now(tz=pytz.UTC)
+        log.info("Source %s: starting concatenation", name)
+        try:
+            Concatenator(
+                config,
+                num_threads=self.num_threads,
+                io_pool=io_pool.for_source(name),
+                cpu_pool=cpu_pool.for_source(name),
+                memory_budget=self.memory_budget,
+            ).run()
+        except Exception as err:
+            log.exception("Source %s: concatenation failed", name)
+            self.errors[name] = err
+        else:
+            log.info(
+                "Source %s: finished in %s",
+                name,
+                datetime.now(tz=pytz.UTC) - start_time,
+            )
+
+    def run(self) -> None:
+        """Concatenate all sources.
+
+        Raises:
+            RuntimeError: If concatenation of any source failed.
+        """
+        io_pool = FairScheduler("io", self.io_threads)
+        cpu_pool = FairScheduler("cpu", self.cpu_threads)
+        threads = [
+            threading.Thread(
+                target=self._run_source,
+                args=(name, config, io_pool, cpu_pool),
+                name=f"source-{name}",
+            )
+            for name, config in self.sources.items()
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            io_pool.shutdown()
+            cpu_pool.shutdown()
+        if self.errors:
+            raise RuntimeError(
+                f"Concatenation failed for sources: {', '.join(self.errors)}"
+            )
@@ -0,0 +1,175 @@
+"""Sharded concatenation: several workers split the archive by UTC day."""
+from typing import Iterator, Tuple, Union
+from datetime import datetime, timedelta
+import os
+
+import numpy as np
+import pytz
+
+from log.main_logger import logger as log
+from concat.main import Concatenator
+from concat.lease import Lease, LeaseLostError, new_owner_id
+from config import Config
+
+
+class ShardedConcatenator(Concatenator):
+    """Concatenator which claims UTC days through lease files.
+
+    Chunks never cross midnight, so a day is an independent unit of work. Each
+    day keeps its own `last`/`carry.npy` state in `SAVE_PATH/shards/YYYYMMDD`,
+    so several workers (on one or many hosts) can run against the same
+    `LOCAL_PATH` and `SAVE_PATH`. The carry crossing into a day is rebuilt from
+    the packet preceding midnight, so a day does not wait for the previous one.
+    `LOCAL_PATH` is listed once per run and its packets are grouped by day.
+
+    Attributes:
+        owner (str): Unique identifier of this worker.
+        day (datetime): UTC midnight of the day being processed.
+        lease (Lease): Lease of the day being processed.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        num_threads: Union[None, int] = None,
+        owner: Union[None, str] = None,
+    ):
+        super().__init__(config, num_threads=num_threads)
+        self.owner = owner or new_owner_id()
+        self.day: Union[None, datetime] = None
+        self.lease: Union[None, Lease] = None
+        # Packets of each UTC day as (timestamp, [dir, name]), in FIFO order
+        self.day_files: dict = {}
+
+    def _shard_path(self, day: datetime) -> str:
+        return os.path.join(self.config.save_path, "shards", day.strftime("%Y%m%d"))
+
+    def _next_day(self) -> datetime:
+        return self.day + timedelta(days=1)
+
+    def _index_days(self, h5_files_list: list) -> None:
+        """Group packets found in LOCAL_PATH by UTC day, listing the tree once."""
+        self.day_files = {}
+        for file_dir, file_name in h5_files_list:
+            file_timestamp = self._get_file_timestamp(file_name)
+            day = datetime.fromtimestamp(file_timestamp, tz=pytz.UTC).replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            self.day_files.setdefault(day, []).append(
+                (file_timestamp, [file_dir, file_name])
+            )
+
+    def _get_shard_days(self) -> list:
+        """Get UTC days covered by packets in LOCAL_PATH, oldest first."""
+        return sorted(self.day_files)
+
+    def _get_boundary_packet(self) -> Union[None, list]:
+        """Get the packet preceding the day together with the next packet.
+
+        Returns:
+            list: [next packet, boundary packet] in FIFO order or None if there is
+                no packet preceding the day.
+        """
+        previous_days = [day for day in self.day_files if day < self.day]
+        if not previous_days or self.day not in self.day_files:
+            return None
+        _, boundary = max(self.day_files[max(previous_days)], key=lambda x: x[0])
+        _, next_packet = min(self.day_files[self.day], key=lambda x: x[0])
+        return [next_packet, boundary]
+
+    def _get_day_position(self, shard_path: str) -> float:
+        """Get the time up to which the day is processed, from its `last` state."""
+        if not os.path.exists(os.path.join(shard_path, "last")):
+            return 0
+        with open(os.path.join(shard_path, "last"), "r", encoding="utf-8") as f:
+            chunk_time, chunk_data_offset = [x.strip() for x in f.readlines()]
+        return np.floor(float(chunk_time)) + int(chunk_data_offset) / self.config.sps
+
+    def _get_previous_file_data(self):
+        if os.path.exists(os.path.join(self.state_path, "last")):
+            return super()._get_previous_file_data()
+        if self.config.fixed_grid:
+            # Grid chunks have no carry, the boundary packet is read as a file
+            return 0, 0
+
+        # Shard starts from scratch: rebuild carry the previous day would produce
+        boundary = self._get_boundary_packet()
+        if boundary is None:
+            log.debug("No packet before %s, starting from first packet", self.day)
+            return 0, 0
+        _, file_name, data, _ = self._get_next_packet_data(boundary)
+        file_timestamp = self._get_file_timestamp(file_name)
+        split_index = int(self.sps * np.round(self.day.timestamp() - file_timestamp))
+        if split_index >= data.shape[1]:
+            log.debug("Packet %s ends before %s, no carry", file_name, self.day)
+            return 0, 0
+        log.debug("Rebuilding carry from %s at offset %s", file_name, split_index)
+        self.carry = data[:, split_index:]
+        return file_timestamp, split_index
+
+    def _get_files(self, previous_chunk_time, previous_chunk_data_offset):
+        # Packets of the day from the listing made by iter_chunks
+        files_start = np.floor(previous_chunk_time) + (
+            previous_chunk_data_offset / self.config.sps
+        )
+        h5_files_list = [
+            file
+            for file_timestamp, file in self.day_files.get(self.day, [])
+            if file_timestamp >= files_start
+        ]
+        if self.config.fixed_grid and previous_chunk_time == 0:
+            # Samples after midnight of the packet preceding the day
+            boundary = self._get_boundary_packet()
+            if boundary is not None:
+                h5_files_list.append(boundary[-1])
+        log.debug("Files to process in shard: %s", len(h5_files_list))
+        return h5_files_list
+
+    def _save_chunk_data(self, chunk_data: np.ndarray, buffer: np.ndarray) -> None:
+        # Never write chunks for a day another worker has taken over
+        self.lease.check()
+        super()._save_chunk_data(chunk_data, buffer)
+
+    def _process_day(self, day: datetime) -> Iterator[Tuple[float, np.ndarray, dict]]:
+        shard_path = self._shard_path(day)
+        # Days are never closed: like a plain run, a day resumes from its `last`
+        # state when packets arrive late (e.g. Prisma directories modified today)
+        position = self._get_day_position(shard_path)
+        if all(file_timestamp < position for file_timestamp, _ in self.day_files[day]):
+            log.debug("Day %s has no new packets", day.strftime("%Y%m%d"))
+            return
+        lease = Lease(
+            os.path.join(shard_path, "lease"),
+            ttl=self.config.lease_ttl,
+            heartbeat_interval=self.config.heartbeat_interval,
+            owner=self.owner,
+        )
+        if not lease.acquire():
+            log.debug("Day %s is leased by another worker", day.strftime("%Y%m%d"))
+            return
+        with lease:
+            log.info("Processing day %s as %s", day.strftime("%Y%m%d"), self.owner)
+            self._reset_state()
+            self.day = day
+            self.lease = lease
+            self.state_path = shard_path
+            self.time_window = (day.timestamp(), self._next_day().timestamp())
+            try:
+                yield from self._concat_files()
+            finally:
+                # Chunks queued under the lease are written before releasing it
+                self.writer.flush()
+
+    def iter_chunks(self) -> Iterator[Tuple[float, np.ndarray, dict]]:
+        """Concatenate packets of unclaimed days, yielding chunks as they complete."""
+        self._check_system()
+        log.info("Sharded concatenation as %s", self.owner)
+        self._index_days(super()._get_files(0, 0))
+        try:
+            for day in self._get_shard_days():
+                try:
+                    yield from self._process_day(day)
+                except LeaseLostError as err:
+                    log.error("Stopped processing day %s: %s", day, err)
+        finally:
+            self.writer.close()
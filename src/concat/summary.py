@@ -0,0 +1,91 @@
+"""Per-chunk quick-look summaries computed from the data already in memory."""
+from typing import Tuple
+
+import numpy as np
+
+from concat.utils import thread_map
+
+# Number of channels transformed at once, bounds the FFT memory per thread
+CHANNELS_PER_BLOCK = 64
+
+
+def parse_bands(bands: str) -> list:
+    """Parse frequency bands from config string.
+
+    Args:
+        bands (str): Comma separated bands in Hz, e.g. "1-5,5-20".
+
+    Returns:
+        list: List of (low, high) tuples.
+    """
+    return [
+        tuple(float(edge) for edge in band.split("-"))
+        for band in bands.split(",")
+        if band.strip()
+    ]
+
+
+def _block_summary(
+    block: np.ndarray, sps: float, bands: list
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    flat = np.ptp(block, axis=-1) == 0
+    rms = np.sqrt(np.mean(np.square(block, dtype=np.float64), axis=-1))
+
+    n_samples = block.shape[1]
+    spectrum = np.fft.rfft(block - block.mean(axis=-1, keepdims=True), axis=-1)
+    power = np.square(np.abs(spectrum)) / n_samples**2
+    # One-sided spectrum: every bin except DC (and Nyquist) counts twice
+    power[:, 1:] *= 2
+    if n_samples % 2 == 0:
+        power[:, -1] /= 2
+    freqs = np.fft.rfftfreq(n_samples, d=1 / sps)
+
+    band_energy = np.empty((len(bands), block.shape[0]), dtype=np.float32)
+    for i, (low, high) in enumerate(bands):
+        band_energy[i] = power[:, (freqs >= low) & (freqs < high)].sum(axis=-1)
+    return rms.astype(np.float32), band_energy, flat
+
+
+def multithreaded_summary(
+    chunk_data: np.ndarray,
+    sps: float,
+    bands: list,
+    dead_ratio: float,
+    num_threads: int,
+    executor=None,
+) -> dict:
+    """Compute per-channel summaries of the chunk.
+
+    Args:
+        chunk_data (np.ndarray): Chunk data (channels, samples).
+        sps (float): Sampling rate of the chunk (Hz).
+        bands (list): Frequency bands (low, high) in Hz.
+        dead_ratio (float): Channel is dead if its RMS is below this fraction
+            of the median RMS or if it is flat.
+        num_threads (int): Number of threads.
+        executor (Executor, optional): Shared executor used instead of a new
+            thread pool.
+
+    Returns:
+        dict: `rms` (channels), `band_energy` (bands, channels) as mean power in
+            each band and `dead_channels` (channels) mask.
+    """
+    blocks = np.array_split(
+        chunk_data, max(1, int(np.ceil(chunk_data.shape[0] / CHANNELS_PER_BLOCK)))
+    )
+    results = thread_map(
+        lambda x: _block_summary(x, sps, bands), blocks, num_threads, executor
+    )
+
+    rms = np.concatenate([result[0] for result in results])
+    band_energy = np.hstack([result[1] for result in results])
+    flat = np.concatenate([result[2] for result in results])
+    with np.errstate(invalid="ignore"):
+        weak = rms < dead_ratio * np.nanmedian(rms)
+    dead_channels = flat | ~np.isfinite(rms) | weak
+
+    return {
+        "rms": rms,
+        "band_energy": band_energy,
+        "dead_channels": dead_channels,
+    }
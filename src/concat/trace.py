@@ -0,0 +1,301 @@
+"""Record concatenation runs and replay them on synthetic packet trees.
+
+A trace holds the packet files discovered by a run, the packet attrs and
+shapes, the settings and thread counts used and the timings of each stage,
+without any sample values. `build_tree` recreates an equivalent packet tree
+from a trace, so slow production runs can be profiled offline.
+"""
+from typing import Iterator, Tuple, Union
+from contextlib import contextmanager
+from datetime import datetime
+import gzip
+import json
+import os
+import threading
+import time
+
+import h5py
+import numpy as np
+import pytz
+
+from log.main_logger import logger as log
+from concat.main import Concatenator
+from config import Config
+
+TRACE_VERSION = 1
+# Settings stored in a trace, other settings are host specific
+TRACE_CONFIG = [
+    "system_name",
+    "chunk_size",
+    "sps",
+    "dx",
+    "chunk_buffers",
+    "summary_enabled",
+    "summary_bands",
+    "dead_channel_ratio",
+    "hdf5_layout",
+    "hdf5_chunk_shape",
+    "hdf5_cache_bytes",
+    "fixed_grid",
+    "fill_value",
+    "output_format",
+    "tile_channels",
+    "tile_seconds",
+    "compression_level",
+    "write_threads",
+]
+# Offsets of the SEG-Y file headers and of the samples count in the first trace header
+SEGY_HEADER_BYTES = 3600
+SEGY_TRACE_HEADER_BYTES = 240
+SEGY_SAMPLES_OFFSET = 3714
+
+
+class Trace:
+    """Packet tree and stage timings of a concatenation run.
+
+    Methods recording data are thread-safe, packets are read and chunks are
+    written from several threads.
+    """
+
+    def __init__(self):
+        self.data: dict = {
+            "version": TRACE_VERSION,
+            "config": {},
+            "tuning": {},
+            "dirs": {},
+            "attrs": [],
+            "attr_files": {},
+            "packets": [],
+            "shapes": {},
+            "stages": {},
+            "chunks": [],
+        }
+        self._attrs_index: dict = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the block as a run of the stage."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start_time)
+
+    def add_timing(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self.data["stages"].setdefault(
+                name, {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            stage["count"] += 1
+            stage["total"] += seconds
+            stage["max"] = max(stage["max"], seconds)
+
+    def add_attrs(self, file_path: str, attrs: dict) -> None:
+        # Packet attrs rarely change, store each distinct one once
+        key = json.dumps(attrs, sort_keys=True)
+        with self._lock:
+            if key not in self._attrs_index:
+                self._attrs_index[key] = len(self.data["attrs"])
+                self.data["attrs"].append(json.loads(key))
+            self.data["attr_files"][file_path] = self._attrs_index[key]
+
+    def add_files(self, files: list, local_path: str) -> None:
+        """Record discovered packets, oldest first."""
+        with self._lock:
+            for file_dir, file_name in files:
+                if file_dir not in self.data["dirs"]:
+                    # Prisma directories are ordered by modification time
+                    self.data["dirs"][file_dir] = os.path.getmtime(
+                        os.path.join(local_path, file_dir)
+                    )
+                self.data["packets"].append([file_dir, file_name])
+
+    def add_shape(self, file_dir: str, file_name: str, shape: tuple) -> None:
+        with self._lock:
+            self.data["shapes"][f"{file_dir}/{file_name}"] = list(shape)
+
+    def add_chunk(self, chunk_time: float, seconds: float, samples: int) -> None:
+        with self._lock:
+            self.data["chunks"].append([chunk_time, seconds, samples])
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            with gzip.open(path, "wt", encoding="utf-8") as file:
+                json.dump(self.data, file, separators=(",", ":"))
+        log.info("Trace saved to %s", path)
+
+    @classmethod
+    def load(cls, path: str) -> "Trace":
+        trace = cls()
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            trace.data = json.load(file)
+        if trace.data.get("version") != TRACE_VERSION:
+            raise ValueError(f"Trace version {trace.data.get('version')} not supported")
+        return trace
+
+    def config(self, local_path: str, save_path: str) -> Config:
+        """Get settings of the recorded run for the given paths."""
+        settings = dict(self.data["config"])
+        settings["hdf5_chunk_shape"] = tuple(settings["hdf5_chunk_shape"])
+        return Config(
+            local_path=local_path,
+            save_path=save_path,
+            # Replay with the recorded thread counts, not the tuning of this host
+            tuning_file=os.path.join(save_path, "tuning.json"),
+            tuning_overrides=self.data["tuning"],
+            **settings,
+        )
+
+
+class TracingConcatenator(Concatenator):
+    """Concatenator recording its run into a trace file.
+
+    Attributes:
+        trace_path (str): Path of the trace (gzipped JSON).
+        trace (Trace): Recorded run.
+    """
+
+    def __init__(self, config: Config, trace_path: str, **kwargs):
+        super().__init__(config, **kwargs)
+        self.trace_path = trace_path
+        self.trace = Trace()
+        self.trace.data["config"] = {key: getattr(config, key) for key in TRACE_CONFIG}
+        self.trace.data["tuning"] = {
+            "resample_threads": self.num_threads,
+            "resample_splits": self.resample_splits,
+            "copy_threads": self.copy_threads,
+            "copy_splits": self.copy_splits,
+        }
+        self._chunk_start: float = 0
+
+    def read_attrs(self, file_path: str) -> dict:
+        attrs = super().read_attrs(file_path)
+        self.trace.add_attrs(file_path, attrs)
+        return attrs
+
+    def _get_files(self, previous_chunk_time, previous_chunk_data_offset):
+        with self.trace.stage("get_files"):
+            h5_files_list = super()._get_files(
+                previous_chunk_time, previous_chunk_data_offset
+            )
+        self.trace.add_files(h5_files_list[::-1], self.config.local_path)
+        return h5_files_list
+
+    def _read_packet(self, file_dir: str, file_name: str) -> np.ndarray:
+        with self.trace.stage("read_packet"):
+            data = super()._read_packet(file_dir, file_name)
+        self.trace.add_shape(file_dir, file_name, data.shape)
+        return data
+
+    def _resample_data(self, data: np.ndarray) -> np.ndarray:
+        with self.trace.stage("resample"):
+            return super()._resample_data(data)
+
+    def _fill_chunk_data(self, *args, **kwargs):
+        with self.trace.stage("fill_chunk"):
+            return super()._fill_chunk_data(*args, **kwargs)
+
+    def _write_chunk(self, *args, **kwargs) -> None:
+        with self.trace.stage("write_chunk"):
+            super()._write_chunk(*args, **kwargs)
+
+    def _emit_chunk(
+        self, chunk_data: np.ndarray, chunk_buffer: np.ndarray
+    ) -> Iterator[Tuple[float, np.ndarray, dict]]:
+        # Time from the previous chunk, including reading and resampling packets
+        now = time.perf_counter()
+        self.trace.add_chunk(
+            self.chunk_time, now - self._chunk_start, chunk_data.shape[1]
+        )
+        yield from super()._emit_chunk(chunk_data, chunk_buffer)
+        self._chunk_start = time.perf_counter()
+
+    def iter_chunks(self) -> Iterator[Tuple[float, np.ndarray, dict]]:
+        self._chunk_start = time.perf_counter()
+        try:
+            with self.trace.stage("run"):
+                yield from super().iter_chunks()
+        finally:
+            self.trace.save(self.trace_path)
+
+
+def _write_segy(path: str, data: np.ndarray) -> None:
+    records, samples = data.shape
+    segy_data = np.zeros(
+        records,
+        dtype=[("headers", np.void, SEGY_TRACE_HEADER_BYTES), ("data", "f4", samples)],
+    )
+    segy_data["data"] = data
+    with open(path, "wb") as file:
+        file.write(bytes(SEGY_HEADER_BYTES))
+        segy_data.tofile(file)
+        file.seek(SEGY_SAMPLES_OFFSET)
+        file.write(np.array([samples], dtype=np.int16).tobytes())
+
+
+def build_tree(
+    trace: Trace, local_path: str, max_packets: Union[None, int] = None
+) -> int:
+    """Recreate the recorded packet tree with synthetic sample values.
+
+    Args:
+        trace (Trace): Recorded run.
+        local_path (str): Directory for the packets (LOCAL_PATH of the replay).
+        max_packets (int, optional): Recreate only the first packets.
+
+    Returns:
+        int: Number of packets written.
+    """
+    system = trace.data["config"]["system_name"]
+    packets = trace.data["packets"][:max_packets]
+    rng = np.random.default_rng(0)
+    # One block of values per packet shape, packet trees can be large
+    blocks: dict = {}
+    for file_path, attrs_index in trace.data["attr_files"].items():
+        os.makedirs(os.path.join(local_path, os.path.dirname(file_path)), exist_ok=True)
+        with open(os.path.join(local_path, file_path), "w", encoding="utf-8") as file:
+            json.dump(trace.data["attrs"][attrs_index], file)
+
+    written = 0
+    for file_dir, file_name in packets:
+        shape = trace.data["shapes"].get(f"{file_dir}/{file_name}")
+        if shape is None:
+            # Discovered, but not read (e.g. the run failed)
+            continue
+        shape = tuple(shape)
+        if shape not in blocks:
+            blocks[shape] = rng.standard_normal(shape, dtype=np.float32)
+        os.makedirs(os.path.join(local_path, file_dir), exist_ok=True)
+        packet_path = os.path.join(local_path, file_dir, file_name)
+        if system == "Mekorot":
+            with h5py.File(packet_path, "w") as file:
+                file["data_down"] = blocks[shape].T
+        elif system == "Prisma":
+            _write_segy(packet_path, blocks[shape])
+        else:
+            raise ValueError("System not supported")
+        written += 1
+
+    for file_dir, mtime in trace.data["dirs"].items():
+        if os.path.isdir(os.path.join(local_path, file_dir)):
+            os.utime(os.path.join(local_path, file_dir), (mtime, mtime))
+    log.info("Recreated %s packets in %s", written, local_path)
+    return written
+
+
+def summarize(trace: Trace) -> str:
+    """Format stage timings and the slowest chunks of a trace."""
+    lines = [f"{'stage':<14}{'count':>8}{'total s':>12}{'mean ms':>12}{'max ms':>12}"]
+    for name, stage in trace.data["stages"].items():
+        lines.append(
+            f"{name:<14}{stage['count']:>8}{stage['total']:>12.2f}"
+            f"{stage['total'] / stage['count'] * 1000:>12.2f}{stage['max'] * 1000:>12.2f}"
+        )
+    slowest = sorted(trace.data["chunks"], key=lambda chunk: chunk[1], reverse=True)
+    for chunk_time, seconds, samples in slowest[:5]:
+        chunk_datetime = datetime.fromtimestamp(chunk_time, tz=pytz.UTC)
+        lines.append(
+            f"slow chunk {chunk_datetime:%Y-%m-%d %H:%M:%S}: {seconds:.2f} s, {samples} samples"
+        )
+    return "\n".join(lines)
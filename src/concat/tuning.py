@@ -0,0 +1,158 @@
+"""Automatic tuning of thread counts and work-split sizes for the current host."""
+from typing import Callable, Tuple, Union
+import os
+import json
+import socket
+import time
+
+import numpy as np
+
+from log.main_logger import logger as log
+from concat.utils import multithreaded_mean, multithreaded_copy
+from config import Config
+
+# Settings used when the host was never tuned (resampling as before autotune)
+DEFAULT_TUNING = {
+    "resample_threads": 4,
+    "resample_splits": 4,
+    "copy_threads": 1,
+    "copy_splits": 1,
+}
+
+# Synthetic workload: one packet of AUTOTUNE_SECONDS before time downsampling
+AUTOTUNE_CHANNELS = 2500
+AUTOTUNE_SECONDS = 10
+AUTOTUNE_DOWN_FACTOR = 5
+AUTOTUNE_REPEATS = 3
+# Tried numbers of splits per thread
+AUTOTUNE_SPLITS_PER_THREAD = (1, 2, 4, 8)
+
+
+def tuning_path(config: Config) -> Union[None, str]:
+    """Get path to the tuning file of the current host."""
+    if config.tuning_file:
+        return config.tuning_file
+    if config.save_path is None:
+        return None
+    return os.path.join(config.save_path, "tuning", socket.gethostname() + ".json")
+
+
+def load_tuning(config: Config, num_threads: Union[None, int] = None) -> dict:
+    """Load tuning of the current host and apply overrides.
+
+    Precedence: `num_threads` (CLI), `[TUNING]` in config.ini, tuning file,
+    defaults.
+
+    Args:
+        config (Config): Concatenation settings.
+        num_threads (int, optional): Number of threads for resampling.
+
+    Returns:
+        dict: Thread counts and number of splits for resampling and copying.
+    """
+    tuning = dict(DEFAULT_TUNING)
+    path = tuning_path(config)
+    if path is not None and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            tuning.update(
+                {key: value for key, value in json.load(f).items() if key in tuning}
+            )
+        log.debug("Loaded tuning from %s", path)
+    else:
+        log.debug("No tuning found at %s, using defaults", path)
+    tuning.update(config.tuning_overrides)
+    if num_threads:
+        tuning["resample_threads"] = num_threads
+        if "resample_splits" not in config.tuning_overrides:
+            tuning["resample_splits"] = num_threads
+    log.debug("Tuning: %s", tuning)
+    return tuning
+
+
+def save_tuning(config: Config, tuning: dict) -> str:
+    """Save tuning of the current host.
+
+    Returns:
+        str: Path to the tuning file.
+    """
+    path = tuning_path(config)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(tuning, f, indent=4)
+    return path
+
+
+def _measure(func: Callable) -> float:
+    timings = []
+    for _ in range(AUTOTUNE_REPEATS):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def _thread_candidates() -> list:
+    cpu_count = os.cpu_count() or 1
+    candidates = {1, cpu_count}
+    num_threads = 2
+    while num_threads < cpu_count:
+        candidates.add(num_threads)
+        num_threads *= 2
+    return sorted(candidates)
+
+
+def _find_best(name: str, func: Callable) -> Tuple[int, int]:
+    """Find the fastest (threads, splits) pair for `func(threads, splits)`."""
+    best = (np.inf, 1, 1)
+    for num_threads in _thread_candidates():
+        for splits_per_thread in AUTOTUNE_SPLITS_PER_THREAD:
+            # Splitting a single thread's work only adds overhead
+            if num_threads == 1 and splits_per_thread > 1:
+                continue
+            num_splits = num_threads * splits_per_thread
+            timing = _measure(lambda: func(num_threads, num_splits))
+            log.debug(
+                "%s: %s threads, %s splits: %.4fs",
+                name,
+                num_threads,
+                num_splits,
+                timing,
+            )
+            best = min(best, (timing, num_threads, num_splits))
+    log.info("%s: best %s threads, %s splits (%.4fs)", name, best[1], best[2], best[0])
+    return best[1], best[2]
+
+
+def autotune(config: Config) -> dict:
+    """Measure resampling and copying on a synthetic packet.
+
+    Returns:
+        dict: The fastest thread counts and number of splits.
+    """
+    rng = np.random.default_rng()
+    packet = rng.standard_normal(
+        (AUTOTUNE_CHANNELS, int(config.sps * AUTOTUNE_SECONDS), AUTOTUNE_DOWN_FACTOR),
+        dtype=np.float32,
+    )
+    resample_threads, resample_splits = _find_best(
+        "Resampling",
+        lambda num_threads, num_splits: multithreaded_mean(
+            packet, num_threads, num_splits
+        ),
+    )
+
+    data = packet[..., 0].copy()
+    chunk_data = np.empty((data.shape[0], 2 * data.shape[1]), dtype=np.float32)
+    copy_threads, copy_splits = _find_best(
+        "Copying",
+        lambda num_threads, num_splits: multithreaded_copy(
+            chunk_data[:, data.shape[1] :], data, num_threads, num_splits
+        ),
+    )
+
+    return {
+        "resample_threads": resample_threads,
+        "resample_splits": resample_splits,
+        "copy_threads": copy_threads,
+        "copy_splits": copy_splits,
+    }
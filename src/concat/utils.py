@@ -23,14 +23,45 @@ def multithreaded_sum(arr, num_threads):
     return result
 
 
-def multithreaded_mean(arr, num_thread):
+def thread_map(func, iterable, num_threads, executor=None):
+    # Use shared executor if provided (see concat/service.py), otherwise a new pool
+    if executor is not None:
+        return list(executor.map(func, iterable))
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(executor.map(func, iterable))
+
+
+def multithreaded_mean(arr, num_thread, num_splits=None, executor=None):
     def mean_chunk(chunk):
         return np.mean(chunk, axis=-1, dtype=np.float32)
 
-    with ThreadPoolExecutor(max_workers=num_thread) as executor:
-        chunks = np.array_split(arr, num_thread, axis=1)
-        results = executor.map(mean_chunk, chunks)
+    # By default split into one piece per thread
+    num_splits = num_splits or num_thread
+    chunks = np.array_split(arr, min(num_splits, arr.shape[1]), axis=1)
+    results = thread_map(mean_chunk, chunks, num_thread, executor)
 
-    result = np.hstack(list(results))
+    result = np.hstack(results)
 
     return result
+
+
+def multithreaded_copy(dst, src, num_threads, num_splits=None, executor=None):
+    # Plain assignment is faster for a single thread
+    if num_threads <= 1:
+        dst[...] = src
+        return
+
+    def copy_chunk(chunks):
+        np.copyto(*chunks)
+
+    # Split along channels, so every piece is a set of contiguous rows
+    num_splits = min(num_splits or num_threads, dst.shape[0])
+    thread_map(
+        copy_chunk,
+        zip(
+            np.array_split(dst, num_splits, axis=0),
+            np.array_split(src, num_splits, axis=0),
+        ),
+        num_threads,
+        executor,
+    )
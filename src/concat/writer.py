@@ -0,0 +1,175 @@
+"""Reusable chunk buffers flushed to disk by a background writer thread."""
+from typing import Callable, Union
+import queue
+import threading
+
+import numpy as np
+
+from log.main_logger import logger as log
+
+
+class MemoryBudget:
+    """Limit of memory taken by chunk buffers, shared by several writers.
+
+    Attributes:
+        max_bytes (int): Memory limit (in bytes).
+        used_bytes (int): Memory currently taken.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes: int) -> None:
+        """Take memory from the budget, waiting until it is available.
+
+        Raises:
+            ValueError: If `nbytes` can never fit in the budget.
+        """
+        if nbytes > self.max_bytes:
+            raise ValueError(
+                f"Chunk buffers need {nbytes} bytes, memory budget is {self.max_bytes}"
+            )
+        with self._condition:
+            if self.used_bytes + nbytes > self.max_bytes:
+                log.info("Waiting for %s bytes of memory budget", nbytes)
+            self._condition.wait_for(lambda: self.used_bytes + nbytes <= self.max_bytes)
+            self.used_bytes += nbytes
+
+    def release(self, nbytes: int) -> None:
+        """Return memory to the budget."""
+        with self._condition:
+            self.used_bytes -= nbytes
+            self._condition.notify_all()
+
+
+class ChunkWriter:
+    """Pool of preallocated chunk buffers with a dedicated writer thread.
+
+    The main loop takes a free buffer with `get_buffer`, fills it and hands the
+    filled part of it to `submit`. The writer thread calls `write_fn` on it and
+    returns the buffer to the pool, so filling the next chunk overlaps with
+    writing the previous one.
+
+    Attributes:
+        num_buffers (int): Number of buffers in the pool.
+        shape (tuple): Shape of the buffers currently in the pool.
+        memory_budget (MemoryBudget): Budget the buffers are taken from.
+    """
+
+    def __init__(
+        self,
+        write_fn: Callable,
+        num_buffers: int = 2,
+        memory_budget: Union[None, MemoryBudget] = None,
+    ):
+        self.write_fn = write_fn
+        self.num_buffers = max(num_buffers, 1)
+        self.shape: Union[None, tuple] = None
+        self.memory_budget = memory_budget
+        self._pool_bytes = 0
+
+        self._free: queue.Queue = queue.Queue()
+        self._jobs: queue.Queue = queue.Queue()
+        self._error: Union[None, BaseException] = None
+        self._thread: Union[None, threading.Thread] = None
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                self._jobs.task_done()
+                return
+            chunk_data, buffer, kwargs = job
+            try:
+                if self._error is None:
+                    self.write_fn(chunk_data, **kwargs)
+            except BaseException as err:  # re-raised in the main thread
+                log.exception("Background chunk write failed")
+                self._error = err
+            finally:
+                if buffer.shape == self.shape:
+                    self._free.put(buffer)
+                self._jobs.task_done()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise RuntimeError("Background chunk write failed") from err
+
+    def get_buffer(self, shape: tuple) -> np.ndarray:
+        """Get a free buffer of the given shape, waiting for the writer if needed.
+
+        Args:
+            shape (tuple): Shape of the chunk (space samples, time samples).
+
+        Returns:
+            np.ndarray: Buffer with undefined contents.
+        """
+        self._raise_error()
+        if shape != self.shape:
+            # Geometry changed: wait for in-flight writes and drop old buffers
+            self.flush()
+            self._drop_buffers()
+            if self.memory_budget is not None:
+                # Whole pool at once, so writers never wait holding part of it
+                pool_bytes = self.num_buffers * int(np.prod(shape)) * 4
+                self.memory_budget.acquire(pool_bytes)
+                self._pool_bytes = pool_bytes
+            self.shape = shape
+            for _ in range(self.num_buffers):
+                self._free.put(np.empty(shape, dtype=np.float32))
+            log.debug("Allocated %s chunk buffers of shape %s", self.num_buffers, shape)
+        return self._free.get()
+
+    def submit(self, chunk_data: np.ndarray, buffer: np.ndarray, **kwargs) -> None:
+        """Queue chunk data for writing.
+
+        Args:
+            chunk_data (np.ndarray): Chunk data, a view of `buffer`.
+            buffer (np.ndarray): Buffer obtained from `get_buffer`, reused after
+                the chunk is written.
+            **kwargs: Snapshot of the chunk state passed to `write_fn`.
+        """
+        self._raise_error()
+        self._start()
+        self._jobs.put((chunk_data, buffer, kwargs))
+
+    def _drop_buffers(self) -> None:
+        self.shape = None
+        self._free = queue.Queue()
+        if self.memory_budget is not None and self._pool_bytes:
+            self.memory_budget.release(self._pool_bytes)
+            self._pool_bytes = 0
+
+    def release(self, buffer: np.ndarray) -> None:
+        """Return a buffer which was not submitted for writing to the pool."""
+        if buffer.shape == self.shape:
+            self._free.put(buffer)
+
+    def flush(self) -> None:
+        """Wait until all submitted chunks are written.
+
+        Raises:
+            RuntimeError: If writing any of the chunks failed.
+        """
+        if self._thread is not None:
+            self._jobs.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        """Flush pending chunks, stop the writer thread and free the buffers."""
+        try:
+            self.flush()
+        finally:
+            if self._thread is not None:
+                self._jobs.put(None)
+                self._thread.join()
+                self._thread = None
+            self._drop_buffers()
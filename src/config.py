@@ -1,29 +1,224 @@
 import configparser
 from os.path import isdir
+from typing import Union
 
 config_dict = configparser.ConfigParser()
 config_dict.read("config.ini", encoding="UTF-8")
 
-#
-# CONCATENATION CHARACTERISTICS
-SYSTEM_NAME = config_dict["SYSTEM"]["NAME"]
-
-# Concatenated chunk size (in seconds)
-CHUNK_SIZE = int(config_dict["CONSTANTS"]["CONCAT_TIME"])
-
-# PACKET CHARACTERISTICS
-SPS = int(config_dict["CONSTANTS"]["SPS"])
-DX = float(config_dict["CONSTANTS"]["DX"])
-
-# PATHs to files and save
-LOCALPATH = config_dict["PATH"]["LOCALPATH"]
-NASPATH_final = config_dict["PATH"]["NASPATH_final"]
-
-if isdir(LOCALPATH):
-    LOCAL_PATH = LOCALPATH
-else:
-    raise Exception("PATH is not accessible!")
-if isdir(NASPATH_final):
-    SAVE_PATH = NASPATH_final
-else:
-    raise Exception("SAVE_PATH is not accessible!")
+
+class Config:
+    """Concatenation settings.
+
+    Built from config.ini with `load_config` or directly when embedding the
+    concatenation into another application.
+
+    Attributes:
+        system_name (str): DAS system (Mekorot or Prisma).
+        local_path (str): Directory with packets.
+        save_path (str): Directory for chunks and state files. Can be None if
+            chunks are only consumed in-process (see `Concatenator.iter_chunks`).
+        chunk_size (int): Concatenated chunk size (in seconds).
+        sps (int): Time frequency after downsampling (in Hz).
+        dx (float): Spatial spacing after downsampling (in m).
+        chunk_buffers (int): Number of preallocated chunk buffers.
+        summary_enabled (bool): Store per-channel summaries in chunk files.
+        summary_bands (str): Frequency bands (in Hz) for band energy.
+        dead_channel_ratio (float): Channel is dead if its RMS is below this
+            fraction of the median RMS.
+        hdf5_layout (str): Layout of data_down (see concat/layout.py).
+        hdf5_chunk_shape (tuple): Chunk shape for the custom layout.
+        hdf5_cache_bytes (int): HDF5 chunk cache size (in bytes).
+        lease_ttl (float): Seconds without heartbeat after which a day lease is
+            considered stale.
+        heartbeat_interval (float): Seconds between lease heartbeats.
+        tuning_file (str): Tuning file, by default SAVE_PATH/tuning/<hostname>.json.
+        tuning_overrides (dict): Values overriding the tuning file.
+        fixed_grid (bool): Align chunks to multiples of CHUNK_SIZE from UTC
+            midnight and fill gaps with `fill_value`.
+        fill_value (float): Value of missing samples in fixed-grid chunks.
+        output_format (str): Chunk files ("hdf5") or a directory store per day
+            ("zarr", see concat/dirstore.py).
+        tile_channels (int): Channels per tile of the directory store.
+        tile_seconds (float): Seconds per tile of the directory store.
+        compression_level (int): zlib level of directory store tiles.
+        write_threads (int): Threads writing directory store tiles.
+    """
+
+    def __init__(
+        self,
+        system_name: str,
+        local_path: str,
+        save_path: Union[None, str] = None,
+        chunk_size: int = 300,
+        sps: int = 100,
+        dx: float = 9.6,
+        chunk_buffers: int = 2,
+        summary_enabled: bool = False,
+        summary_bands: str = "0.1-1,1-10,10-50",
+        dead_channel_ratio: float = 0.01,
+        hdf5_layout: str = "contiguous",
+        hdf5_chunk_shape: tuple = (),
+        hdf5_cache_bytes: int = 1024**2,
+        lease_ttl: float = 600,
+        heartbeat_interval: float = 60,
+        tuning_file: str = "",
+        tuning_overrides: Union[None, dict] = None,
+        fixed_grid: bool = False,
+        fill_value: float = float("nan"),
+        output_format: str = "hdf5",
+        tile_channels: int = 256,
+        tile_seconds: float = 60,
+        compression_level: int = 1,
+        write_threads: int = 4,
+    ):
+        self.system_name = system_name
+        self.local_path = local_path
+        self.save_path = save_path
+        self.chunk_size = chunk_size
+        self.sps = sps
+        self.dx = dx
+        self.chunk_buffers = chunk_buffers
+        self.summary_enabled = summary_enabled
+        self.summary_bands = summary_bands
+        self.dead_channel_ratio = dead_channel_ratio
+        self.hdf5_layout = hdf5_layout
+        self.hdf5_chunk_shape = hdf5_chunk_shape
+        self.hdf5_cache_bytes = hdf5_cache_bytes
+        self.lease_ttl = lease_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.tuning_file = tuning_file
+        self.tuning_overrides = tuning_overrides or {}
+        self.fixed_grid = fixed_grid
+        self.fill_value = fill_value
+        self.output_format = output_format
+        self.tile_channels = tile_channels
+        self.tile_seconds = tile_seconds
+        self.compression_level = compression_level
+        self.write_threads = write_threads
+
+    def check_paths(self) -> None:
+        """Check that configured directories are accessible.
+
+        Raises:
+            Exception: If LOCAL_PATH or SAVE_PATH is not accessible.
+        """
+        if not isdir(self.local_path):
+            raise Exception("PATH is not accessible!")
+        if self.save_path is not None and not isdir(self.save_path):
+            raise Exception("SAVE_PATH is not accessible!")
+
+
+def load_config(config_dict: configparser.ConfigParser = config_dict) -> Config:
+    """Build settings from config.ini.
+
+    Args:
+        config_dict (ConfigParser): Parsed config.ini, by default the one from
+            the working directory.
+
+    Returns:
+        Config: Concatenation settings.
+    Raises:
+        Exception: If LOCALPATH or NASPATH_final is not accessible.
+    """
+    config = Config(
+        #
+        # CONCATENATION CHARACTERISTICS
+        system_name=config_dict["SYSTEM"]["NAME"],
+        # Concatenated chunk size (in seconds)
+        chunk_size=int(config_dict["CONSTANTS"]["CONCAT_TIME"]),
+        # PACKET CHARACTERISTICS
+        sps=int(config_dict["CONSTANTS"]["SPS"]),
+        dx=float(config_dict["CONSTANTS"]["DX"]),
+        # PATHs to files and save
+        local_path=config_dict["PATH"]["LOCALPATH"],
+        save_path=config_dict["PATH"]["NASPATH_final"],
+        # SHARDED PROCESSING (several workers sharing LOCAL_PATH and SAVE_PATH)
+        lease_ttl=config_dict.getfloat("SHARDING", "LEASE_TTL", fallback=600),
+        heartbeat_interval=config_dict.getfloat(
+            "SHARDING", "HEARTBEAT_INTERVAL", fallback=60
+        ),
+        # CHUNK WRITING
+        chunk_buffers=config_dict.getint("WRITER", "CHUNK_BUFFERS", fallback=2),
+        # CHUNK SUMMARIES (per-channel RMS, band energy, dead channels)
+        summary_enabled=config_dict.getboolean("SUMMARY", "ENABLED", fallback=False),
+        summary_bands=config_dict.get("SUMMARY", "BANDS", fallback="0.1-1,1-10,10-50"),
+        dead_channel_ratio=config_dict.getfloat(
+            "SUMMARY", "DEAD_CHANNEL_RATIO", fallback=0.01
+        ),
+        # THREADING (measured with `python src/concat.py --autotune`)
+        tuning_file=config_dict.get("TUNING", "FILE", fallback=""),
+        # Values set in config.ini override the tuning file
+        tuning_overrides={
+            key: config_dict.getint("TUNING", key)
+            for key in (
+                "resample_threads",
+                "resample_splits",
+                "copy_threads",
+                "copy_splits",
+            )
+            if config_dict.has_option("TUNING", key)
+        },
+        # HDF5 LAYOUT of data_down (see concat/layout.py)
+        hdf5_layout=config_dict.get("HDF5", "LAYOUT", fallback="contiguous"),
+        hdf5_chunk_shape=tuple(
+            int(size)
+            for size in config_dict.get("HDF5", "CHUNK_SHAPE", fallback="").split(",")
+            if size.strip()
+        ),
+        hdf5_cache_bytes=int(
+            config_dict.getfloat("HDF5", "CACHE_MB", fallback=1) * 1024**2
+        ),
+        # FIXED GRID chunks (gaps filled, see docs/concat.md)
+        fixed_grid=config_dict.getboolean("GRID", "ENABLED", fallback=False),
+        fill_value=config_dict.getfloat("GRID", "FILL_VALUE", fallback=float("nan")),
+        # OUTPUT FORMAT (chunk files or directory store per day)
+        output_format=config_dict.get("OUTPUT", "FORMAT", fallback="hdf5"),
+        tile_channels=config_dict.getint("OUTPUT", "TILE_CHANNELS", fallback=256),
+        tile_seconds=config_dict.getfloat("OUTPUT", "TILE_SECONDS", fallback=60),
+        compression_level=config_dict.getint("OUTPUT", "COMPRESSION_LEVEL", fallback=1),
+        write_threads=config_dict.getint("OUTPUT", "WRITE_THREADS", fallback=4),
+    )
+    config.check_paths()
+    return config
+
+
+# Options of [SOURCE <name>] sections and the options of config.ini they replace
+SOURCE_OPTIONS = {
+    "NAME": ("SYSTEM", "NAME"),
+    "LOCALPATH": ("PATH", "LOCALPATH"),
+    "NASPATH_final": ("PATH", "NASPATH_final"),
+    "CONCAT_TIME": ("CONSTANTS", "CONCAT_TIME"),
+    "SPS": ("CONSTANTS", "SPS"),
+    "DX": ("CONSTANTS", "DX"),
+}
+
+
+def load_sources(config_dict: configparser.ConfigParser = config_dict) -> dict:
+    """Build settings of every [SOURCE <name>] section of config.ini.
+
+    Source sections set the system, paths, chunk size, SPS and DX of the
+    source, other settings are shared by all sources.
+
+    Args:
+        config_dict (ConfigParser): Parsed config.ini.
+
+    Returns:
+        dict: Source name to its Config.
+    Raises:
+        Exception: If paths of any source are not accessible.
+    """
+    sources = {}
+    for section in config_dict.sections():
+        if not section.startswith("SOURCE "):
+            continue
+        source_dict = configparser.ConfigParser()
+        source_dict.read_dict(config_dict)
+        for option, (target_section, target_option) in SOURCE_OPTIONS.items():
+            if config_dict.has_option(section, option):
+                if not source_dict.has_section(target_section):
+                    source_dict.add_section(target_section)
+                source_dict[target_section][target_option] = config_dict[section][
+                    option
+                ]
+        sources[section.split(" ", 1)[1]] = load_config(source_dict)
+    return sources
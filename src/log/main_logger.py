@@ -1,7 +1,6 @@
 import logging
 from logging.handlers import RotatingFileHandler
 import os
-from config import SAVE_PATH, config_dict
 
 # Create formatter
 formatter = logging.Formatter(
@@ -9,48 +8,60 @@ formatter = logging.Formatter(
     datefmt="%Y-%m-%dT%H:%M:%S",
 )
 
-# Create logger object
-if config_dict["LOG"]["LOG_LEVEL"]:
-    LOG_LEVEL = config_dict["LOG"]["LOG_LEVEL"]
-else:
-    LOG_LEVEL = "INFO"
-
+# Create logger object, handlers are added by setup_logger
 logger = logging.getLogger(__name__)
-logger.setLevel(LOG_LEVEL)
 
-# Create file handler
-file_handler = RotatingFileHandler(
-    os.path.join(SAVE_PATH, "log"), maxBytes=100000000, backupCount=10
-)
-file_handler.setLevel(LOG_LEVEL)
 
-# Set formats and add the handlers to the logger
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+def setup_logger(config_dict, save_path: str) -> None:
+    """Add handlers configured in config.ini to the logger.
 
-# Create stream handler if CONSOLE_LOG is True
-CONSOLE_LOG = config_dict["LOG"]["CONSOLE_LOG"]
-if CONSOLE_LOG == "True":
-    if config_dict["LOG"]["CONSOLE_LOG_LEVEL"]:
-        CONSOLE_LOG_LEVEL = config_dict["LOG"]["CONSOLE_LOG_LEVEL"]
+    Applications embedding the concatenation may skip this and configure
+    logging themselves.
+
+    Args:
+        config_dict (ConfigParser): Parsed config.ini.
+        save_path (str): Directory for the log file.
+    """
+    if config_dict["LOG"]["LOG_LEVEL"]:
+        LOG_LEVEL = config_dict["LOG"]["LOG_LEVEL"]
     else:
-        CONSOLE_LOG_LEVEL = "INFO"
+        LOG_LEVEL = "INFO"
 
-    stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(CONSOLE_LOG_LEVEL)
+    logger.setLevel(LOG_LEVEL)
 
-    stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
+    # Create file handler
+    file_handler = RotatingFileHandler(
+        os.path.join(save_path, "log"), maxBytes=100000000, backupCount=10
+    )
+    file_handler.setLevel(LOG_LEVEL)
 
-TELEGRAM_LOG = config_dict["TELEGRAM"]["TELEGRAM_LOG"]
-if TELEGRAM_LOG == "True":
-    from log.telegram_handler import TelegramBotHandler
+    # Set formats and add the handlers to the logger
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
 
-    if config_dict["TELEGRAM"]["channel"]:
-        telegram_handler = TelegramBotHandler(config_dict["TELEGRAM"]["channel"])
-        telegram_handler.setFormatter(formatter)
-        # Set log level to ERROR to avoid spamming the channel
-        telegram_handler.setLevel(logging.ERROR)
-        logger.addHandler(telegram_handler)
-    else:
-        raise Exception("Telegram channel is not provided.")
+    # Create stream handler if CONSOLE_LOG is True
+    CONSOLE_LOG = config_dict["LOG"]["CONSOLE_LOG"]
+    if CONSOLE_LOG == "True":
+        if config_dict["LOG"]["CONSOLE_LOG_LEVEL"]:
+            CONSOLE_LOG_LEVEL = config_dict["LOG"]["CONSOLE_LOG_LEVEL"]
+        else:
+            CONSOLE_LOG_LEVEL = "INFO"
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setLevel(CONSOLE_LOG_LEVEL)
+
+        stream_handler.setFormatter(formatter)
+        logger.addHandler(stream_handler)
+
+    TELEGRAM_LOG = config_dict["TELEGRAM"]["TELEGRAM_LOG"]
+    if TELEGRAM_LOG == "True":
+        from log.telegram_handler import TelegramBotHandler
+
+        if config_dict["TELEGRAM"]["channel"]:
+            telegram_handler = TelegramBotHandler(config_dict["TELEGRAM"]["channel"])
+            telegram_handler.setFormatter(formatter)
+            # Set log level to ERROR to avoid spamming the channel
+            telegram_handler.setLevel(logging.ERROR)
+            logger.addHandler(telegram_handler)
+        else:
+            raise Exception("Telegram channel is not provided.")
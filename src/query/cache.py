@@ -0,0 +1,92 @@
+"""Size-bounded LRU cache of decoded chunk blocks."""
+from typing import Callable, Hashable
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+
+import numpy as np
+
+
+class BlockCache:
+    """Thread-safe LRU cache of numpy blocks bounded by their total size.
+
+    Concurrent requests for a block which is being loaded wait for the same
+    load instead of reading it again.
+
+    Attributes:
+        max_bytes (int): Maximum total size of cached blocks.
+        nbytes (int): Current total size of cached blocks.
+        hits (int): Number of requests served from memory.
+        misses (int): Number of requests which loaded the block.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._blocks: OrderedDict = OrderedDict()
+        self._loading: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], np.ndarray]) -> np.ndarray:
+        """Get the block, loading it with `load` if it is not cached.
+
+        Returns:
+            np.ndarray: Read-only block.
+        """
+        load_here = False
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return self._blocks[key]
+            future = self._loading.get(key)
+            if future is not None:
+                # Being loaded by another request
+                self.hits += 1
+            else:
+                self.misses += 1
+                future = self._loading[key] = Future()
+                future.set_running_or_notify_cancel()
+                load_here = True
+        if not load_here:
+            return future.result()
+
+        try:
+            block = load()
+            block.flags.writeable = False
+        except BaseException as err:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(err)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._put(key, block)
+        future.set_result(block)
+        return block
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._blocks or key in self._loading
+
+    def _put(self, key: Hashable, block: np.ndarray) -> None:
+        if block.nbytes > self.max_bytes:
+            return
+        self._blocks[key] = block
+        self.nbytes += block.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._blocks.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "blocks": len(self._blocks),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
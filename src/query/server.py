@@ -0,0 +1,83 @@
+"""HTTP server answering time-window queries of concatenated chunks."""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import io
+import json
+
+import numpy as np
+
+from log.main_logger import logger as log
+from query.store import ChunkStore
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Handler of query requests.
+
+    Requests:
+        GET /data?t0=<UTC timestamp>&t1=<UTC timestamp>[&ch0=<first channel>]
+            [&ch1=<channel after last>][&decimation=<factor>]: window as .npy
+            (float32, channels x samples, NaN where there is no data), SPS of
+            the result in the X-SPS header.
+        GET /stats: cache statistics as JSON.
+    """
+
+    server: "QueryServer"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/data":
+            self._send_data(parse_qs(url.query))
+        elif url.path == "/stats":
+            body = json.dumps(self.server.store.cache.stats()).encode()
+            self._send(body, "application/json")
+        else:
+            self.send_error(404, f"Unknown path {url.path}")
+
+    def _send_data(self, params: dict) -> None:
+        try:
+            sps, data = self.server.store.query(
+                float(params["t0"][0]),
+                float(params["t1"][0]),
+                channel_start=int(params.get("ch0", [0])[0]),
+                channel_end=int(params["ch1"][0]) if "ch1" in params else None,
+                decimation=int(params.get("decimation", [1])[0]),
+            )
+        except KeyError as err:
+            self.send_error(400, f"Missing parameter {err}")
+            return
+        except ValueError as err:
+            self.send_error(400, str(err))
+            return
+        except FileNotFoundError as err:
+            self.send_error(404, str(err))
+            return
+        except OSError as err:
+            # Chunk file is being written by the concatenation
+            log.warning("Query %s failed: %s", self.path, err)
+            self.send_error(503, "Chunk is not readable, retry later")
+            return
+        buffer = io.BytesIO()
+        np.save(buffer, data)
+        self._send(buffer.getvalue(), "application/octet-stream", {"X-SPS": str(sps)})
+
+    def _send(self, body: bytes, content_type: str, headers: dict = None) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    """Threaded HTTP server sharing one ChunkStore between requests."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, store: ChunkStore):
+        super().__init__(address, QueryHandler)
+        self.store = store
@@ -0,0 +1,301 @@
+"""Time-window reads of concatenated chunks through a block cache.
+
+Chunks are read from `.h5` files and from Zarr day stores (FORMAT=zarr). A
+chunk of a day store is addressed by (store path, array, first column,
+samples) of its region instead of a file path.
+"""
+from typing import Iterator, Tuple, Union
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+import math
+import os
+import threading
+import time
+
+import h5py
+import numpy as np
+import pytz
+
+from concat.dirstore import DayStore
+from log.main_logger import logger as log
+from query.cache import BlockCache
+
+
+@lru_cache(maxsize=4096)
+def read_chunk_info(path: str, mtime_ns: int) -> Tuple[int, int, float]:
+    """Get channels, samples and SPS of a chunk file.
+
+    `mtime_ns` is a part of the cache key, so rewritten chunks are read again.
+    """
+    with h5py.File(path, "r") as file:
+        channels, samples = file["data_down"].shape
+        sps = float(file.attrs["prr_down"])
+    return channels, samples, sps
+
+
+@lru_cache(maxsize=256)
+def open_day_store(path: str, array: str) -> DayStore:
+    """Open an array of a day store, its geometry never changes once created."""
+    return DayStore.open_existing(path, array)
+
+
+class ChunkStore:
+    """Read time windows of chunks saved as SAVE_PATH/YYYY/YYYYMMDD/<timestamp>.h5
+    or as regions of SAVE_PATH/YYYY/YYYYMMDD.zarr day stores.
+
+    Chunks are read in blocks of all channels over `block_seconds`. Blocks are
+    kept in a BlockCache, so repeated and overlapping queries are served from
+    memory, and blocks adjacent to a query are read in the background.
+
+    Attributes:
+        save_path (str): SAVE_PATH of the concatenation.
+        cache (BlockCache): Cache of decoded blocks.
+        block_seconds (float): Duration of a block (in seconds).
+        prefetch_blocks (int): Number of blocks read ahead before and after a
+            query, 0 to disable prefetching.
+        listing_ttl (float): Seconds a listing of a day directory is reused.
+        max_response_bytes (int): Maximum size of a query result.
+        max_window_seconds (float): Maximum duration of a query window, checked
+            before listing any directory.
+        hdf5_cache_bytes (int): HDF5 chunk cache size for reading blocks.
+    """
+
+    def __init__(
+        self,
+        save_path: str,
+        cache: BlockCache,
+        block_seconds: float = 10,
+        prefetch_blocks: int = 1,
+        listing_ttl: float = 5,
+        max_response_bytes: int = 256 * 1024**2,
+        max_window_seconds: float = 7 * 86400,
+        hdf5_cache_bytes: int = 1024**2,
+        prefetch_threads: int = 2,
+    ):
+        self.save_path = save_path
+        self.cache = cache
+        self.block_seconds = block_seconds
+        self.prefetch_blocks = prefetch_blocks
+        self.listing_ttl = listing_ttl
+        self.max_response_bytes = max_response_bytes
+        self.max_window_seconds = max_window_seconds
+        self.hdf5_cache_bytes = hdf5_cache_bytes
+
+        self._listings: dict = {}
+        self._listings_lock = threading.Lock()
+        self._prefetch_pool: Union[None, ThreadPoolExecutor] = None
+        if prefetch_blocks > 0:
+            self._prefetch_pool = ThreadPoolExecutor(
+                prefetch_threads, thread_name_prefix="prefetch"
+            )
+
+    def _list_day(self, day: datetime) -> list:
+        """Get (chunk start, source, mtime_ns) of chunks of the day sorted by start.
+
+        Source is the path of a chunk file or (store path, array, first column,
+        samples) of a day store region.
+        """
+        date = day.strftime("%Y%m%d")
+        now = time.monotonic()
+        with self._listings_lock:
+            listing = self._listings.get(date)
+            if listing is not None and now - listing[0] < self.listing_ttl:
+                return listing[1]
+
+        chunks = []
+        day_path = os.path.join(self.save_path, day.strftime("%Y"), date)
+        if os.path.isdir(day_path):
+            with os.scandir(day_path) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".h5"):
+                        continue
+                    try:
+                        start = float(entry.name[: -len(".h5")])
+                    except ValueError:
+                        continue
+                    chunks.append((start, entry.path, entry.stat().st_mtime_ns))
+        store_path = day_path + ".zarr"
+        if os.path.isdir(store_path):
+            for region in DayStore.read_regions(store_path):
+                source = (
+                    store_path,
+                    region["array"],
+                    region["start"],
+                    region["samples"],
+                )
+                chunks.append((float(region["time"]), source, region["mtime_ns"]))
+        chunks.sort(key=lambda chunk: chunk[0])
+        with self._listings_lock:
+            self._listings[date] = (now, chunks)
+        return chunks
+
+    def _chunks(self, t0: float, t1: float) -> Iterator[tuple]:
+        """Get chunks overlapping [t0, t1).
+
+        Yields:
+            tuple: chunk start, source, mtime_ns, channels, samples and SPS.
+        """
+        # Chunks never cross midnight
+        day = datetime.fromtimestamp(t0, tz=pytz.UTC).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        while day.timestamp() < t1:
+            chunks = self._list_day(day)
+            # Chunks do not overlap, earlier chunks end before the one holding t0
+            first = max(bisect_right([chunk[0] for chunk in chunks], t0) - 1, 0)
+            for start, source, mtime_ns in chunks[first:]:
+                if start >= t1:
+                    break
+                if isinstance(source, str):
+                    channels, samples, sps = read_chunk_info(source, mtime_ns)
+                else:
+                    day_store = open_day_store(source[0], source[1])
+                    channels, samples, sps = (
+                        day_store.channels,
+                        source[3],
+                        float(day_store.sps),
+                    )
+                if start + samples / sps > t0:
+                    yield start, source, mtime_ns, channels, samples, sps
+            day += timedelta(days=1)
+
+    def _block_samples(self, sps: float) -> int:
+        return max(1, int(np.round(self.block_seconds * sps)))
+
+    def _get_block(
+        self, source: Union[str, tuple], mtime_ns: int, index: int, block_samples: int
+    ) -> np.ndarray:
+        def load() -> np.ndarray:
+            log.debug("Reading block %s of %s", index, source)
+            if not isinstance(source, str):
+                store_path, array, column, samples = source
+                return open_day_store(store_path, array).read(
+                    column + index * block_samples,
+                    column + min((index + 1) * block_samples, samples),
+                )
+            with h5py.File(source, "r", rdcc_nbytes=self.hdf5_cache_bytes) as file:
+                return file["data_down"][
+                    :, index * block_samples : (index + 1) * block_samples
+                ]
+
+        return self.cache.get((source, mtime_ns, block_samples, index), load)
+
+    @staticmethod
+    def _overlap(
+        start: float, samples: int, sps: float, t0: float, num_samples: int
+    ) -> Tuple[int, int, int]:
+        """Get position of the chunk in the window and its samples in the window.
+
+        Returns:
+            tuple: Window index of the first chunk sample and the range
+                [first, last) of chunk samples inside the window.
+        """
+        offset = int(np.round((start - t0) * sps))
+        return offset, max(0, -offset), min(samples, num_samples - offset)
+
+    def query(
+        self,
+        t0: float,
+        t1: float,
+        channel_start: int = 0,
+        channel_end: Union[None, int] = None,
+        decimation: int = 1,
+    ) -> Tuple[float, np.ndarray]:
+        """Read channels [channel_start, channel_end) over [t0, t1).
+
+        Samples not covered by any chunk are NaN. With `decimation` the result
+        is averaged over groups of `decimation` samples.
+
+        Args:
+            t0 (float): Start of the window (UTC timestamp).
+            t1 (float): End of the window (UTC timestamp).
+            channel_start (int): First channel.
+            channel_end (int): Channel after the last one, None for all.
+            decimation (int): Time decimation factor.
+
+        Returns:
+            tuple: SPS of the result and data (channels, samples), the first
+                sample is at t0.
+        Raises:
+            ValueError: If the query is invalid or too large, or if chunks in the
+                window have different geometry.
+            FileNotFoundError: If no chunk overlaps the window.
+        """
+        if not (math.isfinite(t0) and math.isfinite(t1)):
+            raise ValueError("t0 and t1 must be finite timestamps")
+        if t1 <= t0:
+            raise ValueError("t1 must be after t0")
+        if t1 - t0 > self.max_window_seconds:
+            raise ValueError(
+                f"Time window is longer than {self.max_window_seconds} seconds"
+            )
+        if decimation < 1:
+            raise ValueError("Decimation must be positive")
+        chunks = list(self._chunks(t0, t1))
+        if not chunks:
+            raise FileNotFoundError(f"No chunks between {t0} and {t1}")
+        if len({(chunk[3], chunk[5]) for chunk in chunks}) > 1:
+            raise ValueError("Chunks in the window have different channels or SPS")
+        _, _, _, channels, _, sps = chunks[0]
+        if channel_end is None or channel_end > channels:
+            channel_end = channels
+        if not 0 <= channel_start < channel_end:
+            raise ValueError(f"Invalid channel range, chunks have {channels} channels")
+        num_samples = int(np.round((t1 - t0) * sps))
+        if (channel_end - channel_start) * num_samples * 4 > self.max_response_bytes:
+            raise ValueError("Query is too large, reduce channels or time window")
+
+        data = np.full(
+            (channel_end - channel_start, num_samples), np.nan, dtype=np.float32
+        )
+        block_samples = self._block_samples(sps)
+        for start, source, mtime_ns, _, samples, _ in chunks:
+            offset, first, last = self._overlap(start, samples, sps, t0, num_samples)
+            if last <= first:
+                continue
+            for index in range(first // block_samples, -(-last // block_samples)):
+                block = self._get_block(source, mtime_ns, index, block_samples)
+                block_start = index * block_samples
+                begin = max(first, block_start)
+                end = min(last, block_start + block.shape[1])
+                data[:, begin + offset : end + offset] = block[
+                    channel_start:channel_end, begin - block_start : end - block_start
+                ]
+        self._prefetch(t0, t1, sps)
+
+        if decimation > 1:
+            num_samples = num_samples // decimation * decimation
+            data = (
+                data[:, :num_samples]
+                .reshape(data.shape[0], -1, decimation)
+                .mean(axis=-1)
+            )
+        return sps / decimation, data
+
+    def _prefetch(self, t0: float, t1: float, sps: float) -> None:
+        """Read blocks adjacent to the window in the background."""
+        if self._prefetch_pool is None:
+            return
+        span = self.prefetch_blocks * self._block_samples(sps) / sps
+        self._prefetch_pool.submit(self._load_window, t1, t1 + span)
+        self._prefetch_pool.submit(self._load_window, t0 - span, t0)
+
+    def _load_window(self, t0: float, t1: float) -> None:
+        try:
+            for start, source, mtime_ns, _, samples, sps in self._chunks(t0, t1):
+                block_samples = self._block_samples(sps)
+                num_samples = int(np.round((t1 - t0) * sps))
+                _, first, last = self._overlap(start, samples, sps, t0, num_samples)
+                if last <= first:
+                    continue
+                for index in range(first // block_samples, -(-last // block_samples)):
+                    if (source, mtime_ns, block_samples, index) not in self.cache:
+                        self._get_block(source, mtime_ns, index, block_samples)
+        except Exception as err:
+            log.debug("Prefetching %s - %s failed: %s", t0, t1, err)
+
+    def close(self) -> None:
+        if self._prefetch_pool is not None:
+            self._prefetch_pool.shutdown(wait=False)
@@ -0,0 +1,57 @@
+from query.cache import BlockCache
+from query.server import QueryServer
+from query.store import ChunkStore
+from config import config_dict
+from log.main_logger import logger as log, setup_logger
+from os.path import isdir
+import argparse
+
+
+parser = argparse.ArgumentParser(
+    description="Serve time-window queries of concatenated chunks."
+)
+parser.add_argument(
+    "--host",
+    default=config_dict.get("QUERY", "HOST", fallback="127.0.0.1"),
+    help="Address to listen on (overrides config.ini)",
+)
+parser.add_argument(
+    "--port",
+    type=int,
+    default=config_dict.getint("QUERY", "PORT", fallback=8765),
+    help="Port to listen on (overrides config.ini)",
+)
+args = parser.parse_args()
+
+save_path = config_dict["PATH"]["NASPATH_final"]
+if not isdir(save_path):
+    raise Exception("SAVE_PATH is not accessible!")
+setup_logger(config_dict, config_dict.get("QUERY", "LOG_PATH", fallback=save_path))
+
+store = ChunkStore(
+    save_path,
+    BlockCache(
+        int(config_dict.getfloat("QUERY", "CACHE_MB", fallback=512) * 1024**2)
+    ),
+    block_seconds=config_dict.getfloat("QUERY", "BLOCK_SECONDS", fallback=10),
+    prefetch_blocks=config_dict.getint("QUERY", "PREFETCH_BLOCKS", fallback=1),
+    listing_ttl=config_dict.getfloat("QUERY", "LISTING_TTL", fallback=5),
+    max_response_bytes=int(
+        config_dict.getfloat("QUERY", "MAX_RESPONSE_MB", fallback=256) * 1024**2
+    ),
+    max_window_seconds=config_dict.getfloat(
+        "QUERY", "MAX_WINDOW_SECONDS", fallback=7 * 86400
+    ),
+    hdf5_cache_bytes=int(
+        config_dict.getfloat("HDF5", "CACHE_MB", fallback=1) * 1024**2
+    ),
+)
+server = QueryServer((args.host, args.port), store)
+log.info("Query server listening on %s:%s", args.host, args.port)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
+    store.close()
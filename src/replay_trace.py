@@ -0,0 +1,54 @@
+"""Replay a recorded concatenation run on a synthetic packet tree.
+
+Usage:
+    python src/concat.py --trace trace.json.gz  (records a run, on the production host)
+    python src/replay_trace.py trace.json.gz [--dir DIR] [--packets N] [--profile FILE]
+
+cProfile sees only the main thread, use a sampling profiler to include packet
+reads and chunk writes running in other threads:
+    py-spy record -o replay.svg -- python src/replay_trace.py trace.json.gz
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import tempfile
+
+from concat.trace import Trace, TracingConcatenator, build_tree, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="Trace recorded with `concat.py --trace`")
+    parser.add_argument("--dir", help="Directory for the packet tree (default: temp)")
+    parser.add_argument("--packets", type=int, help="Replay only the first packets")
+    parser.add_argument("--profile", help="Run under cProfile and save stats to file")
+    parser.add_argument("--top", type=int, default=25, help="Functions to print")
+    args = parser.parse_args()
+
+    trace = Trace.load(args.trace)
+    print("Recorded run:")
+    print(summarize(trace))
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as path:
+        local_path = os.path.join(path, "local")
+        save_path = os.path.join(path, "save")
+        os.makedirs(save_path)
+        build_tree(trace, local_path, args.packets)
+        concatenator = TracingConcatenator(
+            trace.config(local_path, save_path), os.path.join(path, "replay.json.gz")
+        )
+        if args.profile:
+            profiler = cProfile.Profile()
+            profiler.runcall(concatenator.run)
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.top)
+        else:
+            concatenator.run()
+
+    print("Replayed run:")
+    print(summarize(concatenator.trace))
+
+
+if __name__ == "__main__":
+    main()